@@ -4,9 +4,11 @@ import pathlib
 import click
 
 from findex import __version__
-from findex.db import DbExistsError
-from findex.index import Index, Comparison
+from findex.db import DbExistsError, DbVersionError
+from findex.index import Index, Comparison, RootExistsError
 from findex.reporting import ComparisonReport
+from findex.serve import DEFAULT_MEMORY_LIMIT, DatabaseCache, create_server
+from findex.verify import Verification
 
 
 @click.group()
@@ -27,7 +29,36 @@ def cli():
     default=False,
     help="Flag, whether to allow overwriting index file.",
 )
-def index(directory, db, overwrite):
+@click.option(
+    "--hash-cache/--no-hash-cache",
+    default=False,
+    help="Flag, whether to cache file hashes in extended file attributes.",
+)
+@click.option(
+    "--chunk-threshold",
+    type=click.IntRange(min=1),
+    default=None,
+    help="If specified, files of at least this size in MiB are also indexed by content-defined "
+    "chunks, to quantify partial updates in comparisons.",
+)
+@click.option(
+    "--concurrent/--exclusive",
+    default=False,
+    help="Flag, whether the index can be read by other processes while it is created.",
+)
+@click.option(
+    "--into-archives/--no-into-archives",
+    default=False,
+    help="Flag, whether to also index the members of tar and zip archives, without extracting "
+    "them. Members are not included in the file count shown before indexing.",
+)
+@click.option(
+    "--add",
+    is_flag=True,
+    default=False,
+    help="Add the directory as another root to an existing index.",
+)
+def index(directory, db, overwrite, hash_cache, chunk_threshold, concurrent, into_archives, add):
     """Create an hash-based file index for a directory tree.
 
     DIRECTORY is the path to the root of the file tree being indexed.
@@ -35,17 +66,34 @@ def index(directory, db, overwrite):
 
     index_path = pathlib.Path(db).absolute()
     directory_path = pathlib.Path(directory).absolute()
-    if overwrite:
+    if overwrite and not add:
         index_path.unlink(missing_ok=True)
 
+    options = dict(
+        hash_cache=hash_cache,
+        chunk_threshold=chunk_threshold * 1024 * 1024 if chunk_threshold else None,
+        into_archives=into_archives,
+    )
+
     try:
-        Index(index_path).create(directory_path)
+        index_ = Index(index_path, concurrent=concurrent)
+        if add and index_.exists:
+            index_.add_root(directory_path, **options)
+        else:
+            index_.create(directory_path, **options)
     except DbExistsError:
         click.secho(
-            f"The index {db!r} already exists, please choose another file or use the --overwrite "
-            f"option.",
+            f"The index {db!r} already exists, please choose another file, use the --overwrite "
+            f"option or --add the directory as another root.",
             fg="bright_red",
         )
+    except DbVersionError:
+        click.secho(
+            f"The index {db!r} was created by an older version and cannot hold several roots.",
+            fg="bright_red",
+        )
+    except RootExistsError:
+        click.secho(f"The directory {directory!r} is already a root of {db!r}.", fg="bright_red")
     except Exception as ex:
         click.secho(f"An unexpected error occured: {ex}.", fg="bright_red")
         raise
@@ -63,23 +111,53 @@ def index(directory, db, overwrite):
 @click.option(
     "--overwrite/--no-overwrite",
     default=False,
-    help="Flag, whether to allow overwriting comparison file.",
+    help="Flag, whether to recreate comparison file. If not set, an existing comparison is "
+    "updated where the indices changed.",
+)
+@click.option(
+    "--in-memory",
+    is_flag=True,
+    default=False,
+    help="Compare in memory and report the result directly, without creating a comparison file. "
+    "Requires numpy.",
+)
+@click.option(
+    "--xlsx",
+    type=click.Path(),
+    help="Excel report file generated for an in-memory comparison. If not specified a short report "
+    "is printed to the command line.",
 )
-def compare(index1, index2, db, overwrite):
+def compare(index1, index2, db, overwrite, in_memory, xlsx):
     """Compare two file index files INDEX1 and INDEX2."""
     index1 = Index(pathlib.Path(index1))
     index2 = Index(pathlib.Path(index2))
 
+    if in_memory:
+        from findex.memory import MemoryComparison
+
+        c = MemoryComparison().create(index1, index2)
+        if not xlsx:
+            c.report_raw()
+        else:
+            ComparisonReport(c).write(pathlib.Path(xlsx))
+        return
+
     comparison_path = pathlib.Path(db).absolute()
     if overwrite:
         comparison_path.unlink(missing_ok=True)
 
     try:
-        Comparison(comparison_path).create(index1, index2)
-    except DbExistsError:
+        comparison = Comparison(comparison_path)
+        if not comparison.exists:
+            comparison.create(index1, index2)
+        elif comparison.update(index1, index2):
+            click.echo(f"Updated existing comparison {db!r}.")
+        else:
+            click.echo(f"Existing comparison {db!r} is up to date.")
+    except DbVersionError:
         click.secho(
-            f"The comparison {db!r} already exists, please choose another file or use the "
-            f"--overwrite option.",
+            f"The comparison {db!r} was created by an older version and cannot be updated, please "
+            f"choose another file or use the --overwrite option.",
             fg="bright_red",
         )
     except Exception as ex:
@@ -109,5 +187,150 @@ def report(comparison, xlsx):
         ComparisonReport(c).write(pathlib.Path(xlsx))
 
 
+@cli.command()
+@click.argument("index", type=click.Path(exists=True))
+@click.argument("directory", type=click.Path(exists=True))
+@click.option(
+    "--deep/--quick",
+    default=False,
+    help="Flag, whether to rehash files to detect changes not visible in size and modification "
+    "time.",
+)
+@click.option(
+    "--sample",
+    type=click.FloatRange(0.0, 1.0),
+    default=1.0,
+    help="Fraction of unchanged files rehashed in deep mode.",
+)
+@click.option(
+    "--workers",
+    type=click.IntRange(min=1),
+    default=None,
+    help="Number of parallel workers rehashing files in deep mode.",
+)
+@click.option(
+    "--xlsx",
+    type=click.Path(),
+    help="If specified an Excel report file is generated. If not a short report is printed to the "
+    "command line.",
+)
+def verify(index, directory, deep, sample, workers, xlsx):
+    """Verify a directory tree against its index.
+
+    INDEX is the path to the index of the file tree, DIRECTORY the path to its root.
+    """
+    v = Verification(Index(pathlib.Path(index)), pathlib.Path(directory).absolute())
+    try:
+        v.run(deep=deep, sample=sample, workers=workers)
+    except ValueError as ex:
+        click.secho(str(ex), fg="bright_red")
+        return
+
+    if not xlsx:
+        v.report_raw()
+    else:
+        ComparisonReport(v).write(pathlib.Path(xlsx))
+
+
+def _find_root(index: Index, key: str) -> int:
+    root = index.find_root(key)
+    if root is None:
+        raise click.BadParameter(f"{key!r} is no root of index {str(index.path)!r}.")
+    return root
+
+
+@cli.command()
+@click.argument("index", type=click.Path(exists=True))
+def duplicates(index):
+    """List files with identical content in different roots of an index.
+
+    INDEX is the path to an index holding several roots.
+    """
+    index = Index(pathlib.Path(index))
+
+    groups = 0
+    for group in index.iter_duplicates():
+        groups += 1
+        click.echo(f"{group.fhash} ({group.size} bytes):")
+        for path in group.files:
+            click.echo(f"    {path}")
+
+    click.echo(f"Found {groups} groups of duplicate files.")
+
+
+@cli.command()
+@click.argument("index", type=click.Path(exists=True))
+@click.argument("root1")
+@click.argument("root2")
+def difference(index, root1, root2):
+    """List files in one root of an index with content not found in another root.
+
+    INDEX is the path to an index holding several roots. ROOT1 and ROOT2 are given by id or path.
+    """
+    index = Index(pathlib.Path(index))
+
+    files = 0
+    for file in index.iter_root_difference(_find_root(index, root1), _find_root(index, root2)):
+        files += 1
+        click.echo(file.path)
+
+    click.echo(f"Found {files} files only in {root1}.")
+
+
+@cli.command()
+@click.option(
+    "--index",
+    "indices",
+    type=click.Path(exists=True),
+    multiple=True,
+    help="Path to an index file to serve, can be given multiple times.",
+)
+@click.option(
+    "--comparison",
+    "comparisons",
+    type=click.Path(exists=True),
+    multiple=True,
+    help="Path to a comparison file to serve, can be given multiple times.",
+)
+@click.option("--host", default="127.0.0.1", help="Host name to listen on for HTTP queries.")
+@click.option("--port", type=int, default=8642, help="Port to listen on for HTTP queries.")
+@click.option(
+    "--socket",
+    "socket_path",
+    type=click.Path(),
+    help="If specified, queries are answered on this unix socket instead of via HTTP.",
+)
+@click.option(
+    "--memory-limit",
+    type=click.IntRange(min=1),
+    default=DEFAULT_MEMORY_LIMIT // (1024 * 1024),
+    help="Maximum memory in MiB used for databases, least recently used ones are unloaded.",
+)
+def serve(indices, comparisons, host, port, socket_path, memory_limit):
+    """Serve queries to index and comparison files kept in memory.
+
+    Databases are addressed by their file name without extension.
+    """
+    cache = DatabaseCache(memory_limit * 1024 * 1024)
+    for storage_class, paths in ((Index, indices), (Comparison, comparisons)):
+        for path in paths:
+            path = pathlib.Path(path).absolute()
+            cache.register(path.stem, storage_class, path)
+
+    server = create_server(
+        cache,
+        host=host,
+        port=port,
+        socket_path=pathlib.Path(socket_path) if socket_path else None,
+    )
+    click.echo(f"Serving {len(cache.sources)} databases on {socket_path or f'{host}:{port}'}.")
+
+    with server:
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
 if __name__ == "__main__":
     cli()
@@ -12,6 +12,7 @@ DATABASE_TRANSACTION_SIZE = 10000
 """Maximum number of data sets before writing to database."""
 
 META_CREATED = "CREATED"
+META_UPDATED = "UPDATED"
 META_VERSION = "VERSION"
 
 _logger = logging.getLogger(__name__)
@@ -25,11 +26,20 @@ class DbClosedError(Exception):
     """The index is closed and cannot be processed."""
 
 
+class DbVersionError(Exception):
+    """The database was created by an older version and does not support the operation."""
+
+
 class Storage:
-    """Base class for sqlite-based storage."""
+    """Base class for sqlite-based storage.
 
-    def __init__(self, path: pathlib.Path):
+    In concurrent mode, the database uses a write-ahead log, so other processes can read the last
+    flushed state while it is written.
+    """
+
+    def __init__(self, path: pathlib.Path, *, concurrent=False):
         self.path = path
+        self.concurrent = concurrent
         self.connection = None
         self.updates_before_flush = DATABASE_TRANSACTION_SIZE
 
@@ -76,6 +86,9 @@ class Storage:
         )
         self.updates_before_flush = DATABASE_TRANSACTION_SIZE
 
+        if self.concurrent:
+            self.connection.execute("PRAGMA journal_mode=WAL;")
+
         return self
 
     def close(self):
@@ -97,6 +110,21 @@ class Storage:
         _logger.debug("Flushing transaction.")
         self.connection.commit()
 
+    def _has_table(self, name: str) -> bool:
+        """Returns whether table exists, it may be missing in databases of older versions."""
+        assert self.connection, "database must be open"
+        return bool(
+            self.connection.execute(
+                "SELECT 1 FROM sqlite_master WHERE type='table' AND name=(?)", (name,)
+            ).fetchone()
+        )
+
+    def _has_column(self, table: str, column: str) -> bool:
+        """Returns whether table has column, it may be missing in databases of older versions."""
+        assert self.connection, "database must be open"
+        columns = self.connection.execute(f"PRAGMA table_info({table})").fetchall()
+        return any(name == column for _, name, *_ in columns)
+
     def _put_meta(self, key: str, value: str):
         """Add meta information to storage."""
         assert self.connection, "database must be open"
@@ -104,6 +132,18 @@ class Storage:
             "INSERT INTO meta (key,value) VALUES (?,?);", (key, value)
         )
 
+    def _set_meta(self, key: str, value: str):
+        """Add or replace meta information in storage."""
+        assert self.connection, "database must be open"
+        self.connection.execute(
+            "INSERT OR REPLACE INTO meta (key,value) VALUES (?,?);", (key, value)
+        )
+
+    def _delete_meta(self, key: str):
+        """Remove meta information from storage, if present."""
+        assert self.connection, "database must be open"
+        self.connection.execute("DELETE FROM meta WHERE key=(?);", (key,))
+
     def get_meta(self, key: str) -> t.Optional[str]:
         """Returns value for given key or None if not found."""
         assert self.connection, "database must be open"
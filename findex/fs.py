@@ -6,16 +6,54 @@ import logging
 import mmap
 import os
 import pathlib
+import posixpath
+import tarfile
+import time
 import typing as t
+import zipfile
+import zlib
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
 
 # fake hash values to identify non-hashable files:
 FILEHASH_EMPTY = "_empty"
 FILEHASH_INACCESSIBLE_FILE = "_inaccessible_file"
 FILEHASH_WALK_ERROR = "_error: {message}"
 
+HASH_ALGORITHM = "sha1"
+"""Name of hash algorithm used for file content."""
+
+XATTR_HASH = f"user.findex.{HASH_ALGORITHM}"
+"""Extended attribute caching the content hash of a file across runs."""
+
+XATTR_SUPPORTED = hasattr(os, "getxattr") and hasattr(os, "setxattr")
+"""Whether extended file attributes can be used on this platform."""
+
 FileDesc = collections.namedtuple("FileDesc", "path size fhash created modified")
 """Descriptor for a file in index."""
 
+FileId = collections.namedtuple("FileId", "device inode links")
+"""Identity of a file on its device, shared by all hard links to the same data."""
+
+FILEID_UNKNOWN = FileId(device=None, inode=None, links=None)
+
+Chunk = collections.namedtuple("Chunk", "offset size fhash")
+"""Content-defined chunk of a file."""
+
+CHUNK_SIZE_MIN = 256 * 1024
+CHUNK_SIZE_AVG = 1024 * 1024
+CHUNK_SIZE_MAX = 4 * 1024 * 1024
+"""Limits and expected size of content-defined chunks."""
+
+READ_BLOCK_SIZE = 4 * 1024 * 1024
+"""Number of bytes read at once when chunking a file."""
+
+ARCHIVE_SUFFIXES = (".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tbz2", ".tar.xz", ".txz", ".zip")
+"""File name suffixes of archives whose members can be indexed without extracting them."""
+
 _logger = logging.getLogger(__name__)
 
 
@@ -37,39 +75,522 @@ def count_bytes(top: pathlib.Path) -> int:
     return count
 
 
-def walk(top: pathlib.Path) -> t.Iterable[FileDesc]:
-    """Recurse given directory and for each non-empty file return content hash and path."""
+def walk(top: pathlib.Path, *, hash_cache=False) -> t.Iterable[FileDesc]:
+    """Recurse given directory and for each non-empty file return content hash and path.
+
+    If hash_cache is set, content hashes are read from and written to extended file attributes,
+    so files unchanged since they were last hashed, by any index, are not read again.
+    """
+    for filedesc, _, _ in iter_files(top, hash_cache=hash_cache):
+        yield filedesc
+
+
+def iter_files(
+    top: pathlib.Path,
+    *,
+    hash_cache=False,
+    chunk_threshold: t.Optional[int] = None,
+    into_archives=False,
+) -> t.Iterable[t.Tuple[FileDesc, FileId, t.Optional[t.List[Chunk]]]]:
+    """Recurse given directory like `walk`, returning file descriptor and identity of each file.
+
+    Hard-linked files are hashed only once, the hash is reused for all other links to the file.
+
+    If chunk_threshold is given, files of at least this size are additionally split into
+    content-defined chunks, returned with their hashes. Other files are returned without chunks.
+
+    If into_archives is set, the members of tar and zip archives are returned as well, with
+    virtual paths below the path of the archive and without identity on disk.
+    """
+    for record in iter_records(
+        top, hash_cache=hash_cache, chunk_threshold=chunk_threshold, into_archives=into_archives
+    ):
+        path, size, filehash, ctime_ns, mtime_ns, device, inode, links, chunks = record
+        filedesc = FileDesc(
+            path=path,
+            size=size,
+            fhash=filehash,
+            created=datetime.datetime.fromtimestamp(ctime_ns / 1e9),
+            modified=datetime.datetime.fromtimestamp(mtime_ns / 1e9),
+        )
+        yield filedesc, FileId(device=device, inode=inode, links=links), chunks
+
+
+def iter_records(
+    top: pathlib.Path,
+    *,
+    hash_cache=False,
+    chunk_threshold: t.Optional[int] = None,
+    into_archives=False,
+) -> t.Iterable[tuple]:
+    """Recurse given directory like `iter_files`, returning a plain tuple per file.
+
+    The tuples are (path, size, hash, ctime_ns, mtime_ns, device, inode, links, chunks), with the
+    path relative to top and timestamps as integer nanoseconds. No objects are created per file
+    beyond the tuple, which makes this the fast path for trees of many small files.
+    """
     _logger.debug(f"Traversing directory {top} recursively.")
+    debug = _logger.isEnabledFor(logging.DEBUG)
 
+    if hash_cache and not XATTR_SUPPORTED:
+        _logger.warning("Extended attributes not supported, hash cache disabled.")
+        hash_cache = False
+
+    # hashes and chunks of files with more than one link, by device and inode:
+    linked_hashes = {}
+
+    top = os.fspath(top)
     for dirpath, dirnames, filenames in os.walk(top):
-        root = pathlib.Path(dirpath)
+        # relative path prefix shared by all files in directory:
+        prefix = os.path.relpath(dirpath, top) + os.sep if dirpath != top else ""
+        dirpath += os.sep
 
         for filename in filenames:
-            filepath = root / filename
-            stat = filepath.stat()
+            filepath = dirpath + filename
+            stat = os.stat(filepath)
             filesize = stat.st_size
 
+            linked = stat.st_nlink > 1 and stat.st_ino != 0
+            chunked = chunk_threshold is not None and filesize >= max(chunk_threshold, 1)
+            archive = into_archives and is_archive(filename)
+            chunks = None
+
             if filesize == 0:
                 filehash = FILEHASH_EMPTY
+            elif linked and not archive and (stat.st_dev, stat.st_ino) in linked_hashes:
+                if debug:
+                    _logger.debug(f"Using hash of hard link to {filepath}.")
+                filehash, chunks = linked_hashes[stat.st_dev, stat.st_ino]
+            elif (
+                hash_cache
+                and not chunked
+                and not archive
+                and (filehash := read_cached_filehash(filepath, stat))
+            ):
+                if debug:
+                    _logger.debug(f"Using cached hash of {filepath}.")
             else:
                 try:
-                    filehash = compute_filehash(filepath)
+                    if archive:
+                        # members are returned before the archive itself:
+                        filehash = yield from iter_archive_records(
+                            filepath, prefix + filename + os.sep
+                        )
+                    elif chunked:
+                        filehash, chunks = compute_chunked_filehash(filepath)
+                    else:
+                        filehash = compute_filehash(filepath)
                 except PermissionError:
                     _logger.warning(f"File inaccessible: {filepath}.")
                     filehash = FILEHASH_INACCESSIBLE_FILE
+                else:
+                    if hash_cache:
+                        write_cached_filehash(filepath, stat, filehash)
+
+            if linked:
+                linked_hashes[stat.st_dev, stat.st_ino] = filehash, chunks
 
-            _logger.debug(f"{filehash} {filepath}")
-            yield FileDesc(
-                path=str(filepath.relative_to(top)),
-                fhash=filehash,
-                size=filesize,
-                created=datetime.datetime.fromtimestamp(stat.st_ctime),
-                modified=datetime.datetime.fromtimestamp(stat.st_mtime),
+            if debug:
+                _logger.debug(f"{filehash} {filepath}")
+
+            yield (
+                prefix + filename,
+                filesize,
+                filehash,
+                stat.st_ctime_ns,
+                stat.st_mtime_ns,
+                stat.st_dev,
+                stat.st_ino,
+                stat.st_nlink,
+                chunks,
             )
 
 
+def is_archive(filename: str) -> bool:
+    """Returns whether file name denotes an archive, whose members can be indexed."""
+    return filename.lower().endswith(ARCHIVE_SUFFIXES)
+
+
+def iter_archive_records(filepath: str, prefix: str) -> t.Generator[tuple, None, str]:
+    """Return a record like `iter_records` for each file in a tar or zip archive.
+
+    Members are hashed while the archive is read, without extracting them to disk. Their paths are
+    prefixed by the given path of the archive, timestamps are the modification time of the member
+    and the identity on disk is unknown. Finally returns the hash of the archive file itself, for
+    tar archives computed in the same read pass.
+
+    Of members with the same path, e.g. in appended tar archives, only the last one is returned,
+    as it is the one extracted. So records are returned once the archive has been read.
+    """
+    records: t.Dict[str, tuple] = {}
+    filehash = None
+
+    try:
+        if filepath.lower().endswith(".zip"):
+            _read_zip_records(filepath, prefix, records)
+        else:
+            filehash = _read_tar_records(filepath, prefix, records)
+    except PermissionError:
+        raise
+    except (OSError, EOFError, tarfile.TarError, zipfile.BadZipFile, zlib.error) as ex:
+        _logger.warning(f"Cannot read archive {filepath}: {ex}")
+
+    yield from records.values()
+    return filehash or compute_filehash(filepath)
+
+
+class _HashingReader:
+    """Read-only file wrapper, hashing all data read through it."""
+
+    def __init__(self, file):
+        self.file = file
+        self.sha1 = hashlib.sha1()
+
+    def read(self, size=-1) -> bytes:
+        data = self.file.read(size)
+        self.sha1.update(data)
+        return data
+
+
+def _read_tar_records(filepath: str, prefix: str, records: t.Dict[str, tuple]) -> str:
+    with open(filepath, "rb") as file:
+        reader = _HashingReader(file)
+
+        # stream mode reads archive sequentially, with any compression:
+        with tarfile.open(fileobj=reader, mode="r|*") as tar:
+            for member in tar:
+                if not member.isfile():
+                    continue
+
+                path = _archive_member_path(prefix, member.name)
+                if path is None:
+                    continue
+
+                mtime_ns = int(member.mtime * 1_000_000_000)
+                _add_archive_record(
+                    records,
+                    _archive_record(path, member.size, tar.extractfile(member), mtime_ns),
+                )
+
+        # data following the archive is part of the file hash:
+        while reader.read(READ_BLOCK_SIZE):
+            pass
+
+    return reader.sha1.hexdigest()
+
+
+def _read_zip_records(filepath: str, prefix: str, records: t.Dict[str, tuple]):
+    with zipfile.ZipFile(filepath) as archive:
+        for info in archive.infolist():
+            if info.is_dir():
+                continue
+
+            path = _archive_member_path(prefix, info.filename)
+            if path is None:
+                continue
+
+            mtime_ns = int(time.mktime(info.date_time + (0, 0, -1))) * 1_000_000_000
+            try:
+                member = archive.open(info)
+            except RuntimeError:
+                # encrypted member:
+                member = None
+
+            _add_archive_record(records, _archive_record(path, info.file_size, member, mtime_ns))
+
+
+def _add_archive_record(records: t.Dict[str, tuple], record: tuple):
+    path = record[0]
+    if path in records:
+        _logger.warning(f"Archive member {path} found again, replacing earlier one.")
+        del records[path]
+    records[path] = record
+
+
+def _archive_member_path(prefix: str, name: str) -> t.Optional[str]:
+    """Return virtual path of archive member, or None if its name points outside the archive."""
+    name = posixpath.normpath(name.lstrip("/"))
+    if name == ".." or name.startswith("../"):
+        _logger.warning(f"Archive member outside of archive skipped: {prefix}{name}.")
+        return None
+    return prefix + name.replace("/", os.sep)
+
+
+def _archive_record(path: str, size: int, member, mtime_ns: int) -> tuple:
+    if member is None:
+        _logger.warning(f"Archive member inaccessible: {path}.")
+        filehash = FILEHASH_INACCESSIBLE_FILE
+    elif size == 0:
+        filehash = FILEHASH_EMPTY
+    else:
+        sha1 = hashlib.sha1()
+        with member:
+            while block := member.read(READ_BLOCK_SIZE):
+                sha1.update(block)
+        filehash = sha1.hexdigest()
+
+    return path, size, filehash, mtime_ns, mtime_ns, None, None, None, None
+
+
+def scan(top: pathlib.Path) -> t.Iterable[t.Tuple[str, os.stat_result]]:
+    """Recurse given directory and return relative path and stat of each file, without hashing.
+
+    Files are returned ordered by relative path, as text, so the result can be merged with an index
+    sorted by path without loading the whole tree.
+    """
+    _logger.debug(f"Scanning directory {top} recursively.")
+    yield from _scan_sorted(str(top), "")
+
+
+def _scan_sorted(dirpath: str, prefix: str):
+    try:
+        with os.scandir(dirpath) as it:
+            entries = list(it)
+    except OSError as ex:
+        _logger.warning(ex)
+        return
+
+    # directories sort by their name followed by separator, as do all paths in them:
+    entries = [(e.name + os.sep if e.is_dir() else e.name, e) for e in entries]
+    entries.sort(key=lambda item: item[0])
+
+    for key, entry in entries:
+        if key.endswith(os.sep):
+            if not entry.is_symlink():
+                yield from _scan_sorted(entry.path, prefix + key)
+            continue
+
+        try:
+            stat = entry.stat()
+        except OSError as ex:
+            _logger.warning(ex)
+            continue
+
+        yield prefix + key, stat
+
+
 def compute_filehash(filepath: pathlib.Path) -> str:
     with open(filepath, "rb") as file:
         with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
             sha1 = hashlib.sha1(data)
     return sha1.hexdigest()
+
+
+def compute_chunked_filehash(filepath: pathlib.Path) -> t.Tuple[str, t.List[Chunk]]:
+    """Return hash of file and its content-defined chunks, computed in a single read pass."""
+    sha1 = hashlib.sha1()
+    chunker = Chunker()
+    chunks = []
+
+    with open(filepath, "rb") as file:
+        while block := file.read(READ_BLOCK_SIZE):
+            sha1.update(block)
+            chunks.extend(chunker.update(block))
+    chunks.extend(chunker.finish())
+
+    return sha1.hexdigest(), chunks
+
+
+def _gear_table() -> t.List[int]:
+    """Return fixed pseudo-random 32-bit values for all byte values."""
+    return [
+        int.from_bytes(hashlib.sha1(bytes([value])).digest()[:4], "little")
+        for value in range(256)
+    ]
+
+
+class Chunker:
+    """Splits a stream of data into content-defined chunks.
+
+    Chunk boundaries are found with a gear rolling hash as in FastCDC: after the minimum chunk size,
+    a boundary is set where the most significant bits of the hash are zero, which on average
+    happens after the expected chunk size. As boundaries depend on content only, an insertion or
+    deletion only changes the chunks around it.
+    """
+
+    GEAR = _gear_table()
+    GEAR_ARRAY = np.array(GEAR, dtype=np.uint32) if np is not None else None
+
+    WINDOW = 32
+    """Number of last bytes the rolling hash depends on, older ones are shifted out."""
+
+    PIECE_SIZE = 64 * 1024
+    """Number of bytes for which rolling hashes are computed at once."""
+
+    def __init__(
+        self,
+        min_size: int = CHUNK_SIZE_MIN,
+        avg_size: int = CHUNK_SIZE_AVG,
+        max_size: int = CHUNK_SIZE_MAX,
+    ):
+        assert 0 < min_size < avg_size < max_size
+        self.min_size = min_size
+        self.max_size = max_size
+
+        bits = max((avg_size - min_size).bit_length() - 1, 1)
+        self.mask = ((1 << bits) - 1) << (32 - bits)
+
+        self.offset = 0
+        self.tail = b""
+        self._start_chunk()
+
+    def _start_chunk(self):
+        self.length = 0
+        self.rolling_hash = 0
+        self.sha1 = hashlib.sha1()
+
+    def _end_chunk(self) -> Chunk:
+        chunk = Chunk(offset=self.offset, size=self.length, fhash=self.sha1.hexdigest())
+        self.offset += self.length
+        self._start_chunk()
+        return chunk
+
+    def update(self, data: bytes) -> t.List[Chunk]:
+        """Add data to stream, returning chunks completed by it.
+
+        With numpy, boundary candidates are searched for the whole data at once, else the rolling
+        hash is computed byte by byte in Python, which is much slower.
+        """
+        if np is None:
+            return self._update_bytes(data)
+        return self._update_array(data)
+
+    def _boundary_candidates(self, data: bytes) -> "np.ndarray":
+        """Return sorted positions in data where the rolling hash with all window bytes matches.
+
+        The hash at a position is the sum of gear values of the window bytes, shifted by their
+        distance to the position. It is computed for all positions at once by doubling the window
+        width, in pieces fitting into the CPU cache. Positions at the start of data use the tail of
+        the previous data.
+        """
+        stream = np.frombuffer(self.tail + data, dtype=np.uint8)
+        offset = len(stream) - len(data)
+        candidates = []
+
+        for start in range(offset, len(stream), self.PIECE_SIZE):
+            context = max(start - self.WINDOW + 1, 0)
+            values = self.GEAR_ARRAY[stream[context : start + self.PIECE_SIZE]]
+
+            width = 1
+            while width < self.WINDOW:
+                values[width:] += values[:-width] << width
+                width *= 2
+
+            matches = np.flatnonzero((values[start - context :] & self.mask) == 0)
+            candidates.append(matches + (start - offset))
+
+        self.tail = bytes(stream[-(self.WINDOW - 1) :])
+        return np.concatenate(candidates) if candidates else np.empty(0, dtype=np.intp)
+
+    def _update_array(self, data: bytes) -> t.List[Chunk]:
+        chunks = []
+        gear = self.GEAR
+        mask = self.mask
+        view = memoryview(data)
+        position = 0
+
+        candidates = self._boundary_candidates(data)
+
+        while position < len(data):
+            if self.length < self.min_size:
+                # no boundary possible before minimum size, no need to hash:
+                end = min(len(data), position + self.min_size - self.length)
+                boundary = None
+            else:
+                end = min(len(data), position + self.max_size - self.length)
+                boundary = None
+                index = position
+
+                # hash depends on bytes before the minimum size until the window is hashed:
+                hashed = self.length - self.min_size - position
+                h = self.rolling_hash
+                while index < end and hashed + index + 1 < self.WINDOW:
+                    h = ((h << 1) + gear[data[index]]) & 0xFFFFFFFF
+                    if not h & mask:
+                        boundary = index
+                        break
+                    index += 1
+                self.rolling_hash = h
+
+                if boundary is None and index < end:
+                    candidate = np.searchsorted(candidates, index)
+                    if candidate < len(candidates) and candidates[candidate] < end:
+                        boundary = int(candidates[candidate])
+
+                if boundary is not None:
+                    end = boundary + 1
+
+            self.sha1.update(view[position:end])
+            self.length += end - position
+            position = end
+
+            if boundary is not None or self.length >= self.max_size:
+                chunks.append(self._end_chunk())
+
+        return chunks
+
+    def _update_bytes(self, data: bytes) -> t.List[Chunk]:
+        chunks = []
+        gear = self.GEAR
+        mask = self.mask
+        view = memoryview(data)
+        position = 0
+
+        while position < len(data):
+            if self.length < self.min_size:
+                # no boundary possible before minimum size, no need to hash:
+                end = min(len(data), position + self.min_size - self.length)
+                boundary = False
+            else:
+                end = min(len(data), position + self.max_size - self.length)
+                boundary = False
+                h = self.rolling_hash
+
+                for index in range(position, end):
+                    h = ((h << 1) + gear[data[index]]) & 0xFFFFFFFF
+                    if not h & mask:
+                        end = index + 1
+                        boundary = True
+                        break
+
+                self.rolling_hash = h
+
+            self.sha1.update(view[position:end])
+            self.length += end - position
+            position = end
+
+            if boundary or self.length >= self.max_size:
+                chunks.append(self._end_chunk())
+
+        return chunks
+
+    def finish(self) -> t.List[Chunk]:
+        """Return last chunk of stream, if any."""
+        return [self._end_chunk()] if self.length else []
+
+
+def _hash_cache_key(stat: os.stat_result) -> str:
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def read_cached_filehash(filepath: pathlib.Path, stat: os.stat_result) -> t.Optional[str]:
+    """Return hash cached in extended attributes of file, if still valid for given stat."""
+    try:
+        value = os.getxattr(filepath, XATTR_HASH).decode("ascii")
+    except (OSError, UnicodeDecodeError):
+        return None
+
+    key, _, filehash = value.rpartition(":")
+    if key != _hash_cache_key(stat) or not filehash:
+        return None
+
+    return filehash
+
+
+def write_cached_filehash(filepath: pathlib.Path, stat: os.stat_result, filehash: str):
+    """Store hash in extended attributes of file, valid as long as size and mtime are unchanged."""
+    value = f"{_hash_cache_key(stat)}:{filehash}"
+    try:
+        os.setxattr(filepath, XATTR_HASH, value.encode("ascii"))
+    except OSError as ex:
+        _logger.debug(f"Cannot cache hash of {filepath}: {ex}")
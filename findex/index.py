@@ -1,7 +1,11 @@
 """Index of files in a directory structure."""
+import abc
 import collections
 import contextlib
+import datetime
+import hashlib
 import logging
+import os
 import pathlib
 import sqlite3
 import typing as t
@@ -9,34 +13,121 @@ import typing as t
 import click
 import tqdm
 
-from findex.db import Storage, opened_storage
-from findex.fs import FileDesc, FILEHASH_WALK_ERROR, count_files, walk
+from findex.db import (
+    DATABASE_TRANSACTION_SIZE,
+    META_CREATED,
+    META_UPDATED,
+    DbVersionError,
+    Storage,
+    opened_storage,
+)
+from findex.fs import (
+    FILEHASH_WALK_ERROR,
+    Chunk,
+    FILEID_UNKNOWN,
+    FileDesc,
+    FileId,
+    count_files,
+    iter_records,
+)
 
 META_ROOT_SPECIFIED = "ROOT_SPECIFIED"
 META_ROOT_RESOLVED = "ROOT_RESOLVED"
+META_ROOTS = "ROOTS"
+META_FINGERPRINT = "FINGERPRINT"
+META_FILES_TOTAL = "FILES_TOTAL"
+META_FILES_WRITTEN = "FILES_WRITTEN"
+META_COMPLETED = "COMPLETED"
 
 _logger = logging.getLogger(__name__)
 
 
+BuildProgress = collections.namedtuple("BuildProgress", "files_written files_total completed")
+"""Progress of index creation, as published in concurrent mode.
+
+The total is counted on disk before indexing. Members of archives indexed in addition raise the
+total as they are written.
+"""
+
+Root = collections.namedtuple("Root", "id specified resolved added")
+"""Root directory of files in an index."""
+
+DuplicateGroup = collections.namedtuple("DuplicateGroup", "fhash size files")
+"""Files with identical content in different roots of an index."""
+
+
+class RootExistsError(Exception):
+    """The directory is already a root of the index."""
+
+
 class Index(Storage):
-    """Index of file path by content, based on sqlite."""
+    """Index of file path by content, based on sqlite.
+
+    An index holds the files of one or more root directories. File paths are relative to their
+    root, if files of a single root are requested or the index has only one root. Otherwise they
+    are qualified by the resolved root directory.
+    """
+
+    files_written = 0
+    """Number of files written to index during creation."""
+
+    files_total = 0
+    """Number of files expected in index during creation."""
+
+    def create(
+        self,
+        path: pathlib.Path,
+        *,
+        hash_cache=False,
+        chunk_threshold: t.Optional[int] = None,
+        into_archives=False,
+    ):
+        """Create index of given directory.
 
-    def create(self, path: pathlib.Path):
-        """Create index of given directory."""
+        If hash_cache is set, file hashes are cached in extended file attributes. If
+        chunk_threshold is given, files of at least this size are also indexed by chunks. If
+        into_archives is set, members of tar and zip archives are indexed below the archive path.
+        """
 
         _logger.info(f"Creating index of {path}.")
         self.create_db()
+        self.add_root(
+            path,
+            hash_cache=hash_cache,
+            chunk_threshold=chunk_threshold,
+            into_archives=into_archives,
+        )
+
+    def add_root(
+        self,
+        path: pathlib.Path,
+        *,
+        hash_cache=False,
+        chunk_threshold: t.Optional[int] = None,
+        into_archives=False,
+    ) -> int:
+        """Add files of given directory to existing index, returning the id of the new root."""
+        resolved = str(path.resolve())
+
+        with opened_storage(self):
+            if not self._has_table("root"):
+                raise DbVersionError(self.path)
+            if self.connection.execute(
+                "SELECT 1 FROM root WHERE resolved=(?)", (resolved,)
+            ).fetchone():
+                raise RootExistsError(path)
+
+        _logger.info(f"Adding root {path} to index.")
         errors = []
 
         def _on_error(error: OSError):
             _logger.warning(error)
             errors.append(
-                FileDesc(
-                    path=str(pathlib.Path(error.filename).relative_to(path)),
-                    size=0,
-                    fhash=FILEHASH_WALK_ERROR.format(message=error.strerror),
-                    created=None,
-                    modified=None,
+                (
+                    str(pathlib.Path(error.filename).relative_to(path)),
+                    0,
+                    FILEHASH_WALK_ERROR.format(message=error.strerror),
+                    *(None,) * 5,
                 )
             )
 
@@ -44,49 +135,386 @@ class Index(Storage):
         count = count_files(path, _on_error)
 
         with opened_storage(self):
-            self._put_meta(META_ROOT_SPECIFIED, str(path))
-            self._put_meta(META_ROOT_RESOLVED, str(path.resolve()))
+            root_id = self.connection.execute(
+                "INSERT INTO root (specified,resolved,added) VALUES (?,?,?);",
+                (str(path), resolved, datetime.datetime.now()),
+            ).lastrowid
+
+            if root_id == 1:
+                self._put_meta(META_ROOT_SPECIFIED, str(path))
+                self._put_meta(META_ROOT_RESOLVED, resolved)
+            self._set_meta(META_ROOTS, "\n".join(r.resolved for r in self.roots()))
+
+            self.files_written = self.count()
+            self.files_total = self.files_written + count + len(errors)
+            self._set_meta(META_FILES_TOTAL, str(self.files_total))
+            self._delete_meta(META_COMPLETED)
 
             _logger.debug(f"Writing {len(errors)} walk errors to database.")
-            for errordesc in errors:
-                self._add_file(errordesc)
+            self._add_rows(root_id, errors)
+            self._flush_rows()
 
             _logger.info(f"Found {count} files to be added to index.")
-            for filedesc in tqdm.tqdm(
-                walk(path), total=count, desc="Read", unit="files"
-            ):
-                self._add_file(filedesc)
-                self._on_update()
+            records = iter_records(
+                path,
+                hash_cache=hash_cache,
+                chunk_threshold=chunk_threshold,
+                into_archives=into_archives,
+            )
+            rows = []
+
+            for record in tqdm.tqdm(records, total=count, desc="Read", unit="files"):
+                rows.append(record[:-1])
+                if record[-1]:
+                    self._add_chunks(root_id, record[0], record[-1])
+
+                if len(rows) >= DATABASE_TRANSACTION_SIZE:
+                    self._add_rows(root_id, rows)
+                    rows.clear()
+                    self._flush_rows()
+
+            self._add_rows(root_id, rows)
+            self.files_total = self.files_written
+            self._set_meta(META_FILES_TOTAL, str(self.files_total))
+            if self.concurrent:
+                self._publish_progress()
+            self._set_meta(META_FINGERPRINT, self._compute_fingerprint())
+            self._set_meta(META_COMPLETED, datetime.datetime.now().isoformat())
+
+        return root_id
+
+    def _flush_rows(self):
+        """Flush files written by `add_root`, publishing progress in concurrent mode."""
+        if self.concurrent:
+            self._publish_progress()
+        self._flush()
+
+    def _publish_progress(self):
+        self._set_meta(META_FILES_WRITTEN, str(self.files_written))
+
+        # archive members are not counted beforehand:
+        if self.files_written > self.files_total:
+            self.files_total = self.files_written
+            self._set_meta(META_FILES_TOTAL, str(self.files_total))
+
+    def progress(self) -> BuildProgress:
+        """Return progress of index creation, while created concurrently or after completion."""
+        with opened_storage(self):
+            written = self.get_meta(META_FILES_WRITTEN)
+            total = self.get_meta(META_FILES_TOTAL)
+            completed = self.get_meta(META_COMPLETED)
+
+            return BuildProgress(
+                files_written=int(written) if written else self.count(),
+                files_total=int(total) if total else None,
+                completed=completed is not None,
+            )
 
-    def _add_file(self, filedesc: FileDesc):
+    def _add_rows(self, root_id: int, rows: t.List[tuple]):
+        """Add files given as plain tuples with integer timestamps in nanoseconds."""
         try:
-            self.connection.execute(
-                "INSERT INTO file (path,size,hash,created,modified)"
-                "  VALUES (?,?,?,datetime(?),datetime(?));",
-                filedesc,
+            self.connection.executemany(
+                "INSERT INTO file (root,path,size,hash,created,modified,device,inode,links)"
+                f"  VALUES ({int(root_id)},?,?,?,"
+                "    datetime(? / 1000000000, 'unixepoch', 'localtime'),"
+                "    datetime(? / 1000000000, 'unixepoch', 'localtime'),"
+                "    ?,?,?);",
+                rows,
             )
         except sqlite3.OperationalError:
-            _logger.error(f"Cannot add file to database: {filedesc}")
+            _logger.error(f"Cannot add {len(rows)} files to database.")
             raise
 
-    def count(self):
+        self.files_written += len(rows)
+
+    def _add_chunks(self, root_id: int, path: str, chunks: t.List[Chunk]):
+        self.connection.executemany(
+            "INSERT INTO chunk (root,path,offset,size,hash) VALUES (?,?,?,?,?);",
+            ((root_id, path, *chunk) for chunk in chunks),
+        )
+
+    def roots(self) -> t.List[Root]:
+        """Return all root directories of index."""
+        with opened_storage(self):
+            if not self._has_table("root"):
+                # index of older version, with a single root in meta data:
+                return [
+                    Root(
+                        id=1,
+                        specified=self.get_meta(META_ROOT_SPECIFIED),
+                        resolved=self.get_meta(META_ROOT_RESOLVED),
+                        added=self.get_meta(META_CREATED),
+                    )
+                ]
+
+            rows = self.connection.execute(
+                "SELECT id,specified,resolved,added FROM root ORDER BY id"
+            ).fetchall()
+            return [Root._make(row) for row in rows]
+
+    def find_root(self, key: str) -> t.Optional[int]:
+        """Return id of root given by id, specified or resolved path, or None if not found."""
+        resolved = str(pathlib.Path(key).resolve())
+        for root in self.roots():
+            if key in (str(root.id), root.specified) or resolved == root.resolved:
+                return root.id
+        return None
+
+    def _root_column(self) -> str:
+        """Returns expression for root of file, indices of older versions have a single root."""
+        return "root" if self._has_table("root") else "1"
+
+    def path_column(self, root: t.Optional[int] = None) -> t.Tuple[str, tuple]:
+        """Returns SQL expression for path of files and its parameters.
+
+        Paths are qualified by their resolved root directory, if the index has several roots and
+        none is given.
+        """
         with opened_storage(self):
-            return self.connection.execute("SELECT COUNT(*) from file").fetchone()[0]
+            roots = self.roots()
+            if root is not None or len(roots) == 1:
+                return "path", ()
+
+            cases = " ".join("WHEN ? THEN ?" for _ in roots)
+            params = tuple(v for r in roots for v in (r.id, os.path.join(r.resolved, "")))
+            return f"(CASE {self._root_column()} {cases} END || path)", params
 
-    def iter_all(self):
+    def _iter_rows(
+        self, columns: str, table: str, *, root=None, where="", params=(), ordered=False
+    ):
+        """Return rows of table with qualified path in front of the given columns."""
         with opened_storage(self):
+            path, path_params = self.path_column(root)
+            conditions = [where] if where else []
+            if root is not None:
+                conditions.append(f"{self._root_column()}=?")
+                params = (*params, root)
+
+            query = f"SELECT {path} AS qualified_path,{columns} FROM {table}"
+            if conditions:
+                query += " WHERE " + " AND ".join(conditions)
+            if ordered:
+                query += " ORDER BY qualified_path"
+
             with contextlib.closing(self.connection.cursor()) as cursor:
-                for row in cursor.execute(
-                    "SELECT path,size,hash,created,modified from file"
+                yield from cursor.execute(query, (*path_params, *params))
+
+    def fingerprint(self) -> str:
+        """Return digest of all files in index, changing whenever any file entry changes."""
+        with opened_storage(self):
+            return self.get_meta(META_FINGERPRINT) or self._compute_fingerprint()
+
+    def _compute_fingerprint(self) -> str:
+        _logger.debug(f"Computing fingerprint of {self.path}.")
+        digest = hashlib.sha1()
+        root = self._root_column()
+
+        with contextlib.closing(self.connection.cursor()) as cursor:
+            for table, order in (("file", f"{root},path"), ("chunk", f"{root},path,offset")):
+                if not self._has_table(table):
+                    continue
+
+                for row in cursor.execute(f"SELECT * FROM {table} ORDER BY {order}"):
+                    digest.update("\0".join(map(str, row)).encode(errors="surrogateescape"))
+                    digest.update(b"\n")
+
+        return digest.hexdigest()
+
+    def count(self, *, root: t.Optional[int] = None):
+        with opened_storage(self):
+            if root is None:
+                return self.connection.execute("SELECT COUNT(*) from file").fetchone()[0]
+            return self.connection.execute(
+                f"SELECT COUNT(*) from file WHERE {self._root_column()}=?", (root,)
+            ).fetchone()[0]
+
+    def lookup(
+        self,
+        *,
+        path: t.Optional[str] = None,
+        fhash: t.Optional[str] = None,
+        root: t.Optional[int] = None,
+    ) -> t.List[FileDesc]:
+        """Return files in index with given path relative to its root and/or content hash."""
+        conditions = {"path": path, "hash": fhash}
+        conditions = {column: value for column, value in conditions.items() if value is not None}
+        assert conditions, "path or hash must be given"
+
+        rows = self._iter_rows(
+            "size,hash,created,modified",
+            "file",
+            root=root,
+            where=" AND ".join(f"{column}=?" for column in conditions),
+            params=tuple(conditions.values()),
+            ordered=True,
+        )
+        return [FileDesc._make(row) for row in rows]
+
+    def iter_all(self, *, ordered=False, root: t.Optional[int] = None):
+        """Return all files in index or of given root, if ordered is set sorted by path."""
+        for row in self._iter_rows(
+            "size,hash,created,modified", "file", root=root, ordered=ordered
+        ):
+            yield FileDesc._make(row)
+
+    def iter_chunks(self, *, root: t.Optional[int] = None) -> t.Iterable[t.Tuple[str, Chunk]]:
+        """Return path and chunk of all files indexed by chunks."""
+        with opened_storage(self):
+            if not self._has_table("chunk"):
+                return
+
+            for row in self._iter_rows("offset,size,hash", "chunk", root=root):
+                yield row[0], Chunk._make(row[1:])
+
+    def iter_files(
+        self, *, root: t.Optional[int] = None
+    ) -> t.Iterable[t.Tuple[FileDesc, FileId]]:
+        """Return all files in index with their identity on disk, if recorded."""
+        with opened_storage(self):
+            if not self._has_column("file", "inode"):
+                _logger.warning(f"No file identities in {self.path}, created by old version.")
+                yield from ((f, FILEID_UNKNOWN) for f in self.iter_all(root=root))
+                return
+
+            for row in self._iter_rows(
+                "size,hash,created,modified,device,inode,links", "file", root=root
+            ):
+                yield FileDesc._make(row[:5]), FileId._make(row[5:])
+
+    def iter_duplicates(self) -> t.Iterable[DuplicateGroup]:
+        """Return groups of files with identical content, found in more than one root."""
+        with opened_storage(self):
+            if not self._has_table("root"):
+                return
+
+            prefixes = {r.id: os.path.join(r.resolved, "") for r in self.roots()}
+
+            with contextlib.closing(self.connection.cursor()) as cursor:
+                for fhash, size, files in cursor.execute(
+                    "SELECT "
+                    "  hash,"
+                    "  MIN(size),"
+                    "  group_concat(root || char(31) || path, char(30)) "
+                    "FROM file "
+                    "WHERE hash NOT LIKE '\\_%' ESCAPE '\\' "
+                    "GROUP BY hash "
+                    "HAVING COUNT(DISTINCT root) > 1 "
+                    "ORDER BY hash"
                 ):
-                    yield FileDesc._make(row)
+                    paths = []
+                    for entry in files.split("\x1e"):
+                        root, _, path = entry.partition("\x1f")
+                        paths.append(prefixes[int(root)] + path)
+
+                    yield DuplicateGroup(fhash=fhash, size=size, files=sorted(paths))
+
+    def iter_root_difference(self, root1: int, root2: int) -> t.Iterable[FileDesc]:
+        """Return files of root 1 with content not found in root 2, paths relative to root 1."""
+        for row in self._iter_rows(
+            "size,hash,created,modified",
+            "file AS f",
+            root=root1,
+            where="NOT EXISTS (SELECT 1 FROM file AS g WHERE g.root=? AND g.hash=f.hash)",
+            params=(root2,),
+            ordered=True,
+        ):
+            yield FileDesc._make(row)
+
+
+FilesMap = collections.namedtuple("FilesMap", "fhash size files1 files2 copies1 copies2")
+"""Files in comparison with identical content hash.
+
+Copies count the distinct files on disk, so hard links to the same data count only once.
+"""
 
+LinkGroup = collections.namedtuple("LinkGroup", "fhash size files")
+"""Paths in an index that are hard links to the same file."""
 
-FilesMap = collections.namedtuple("FilesMap", "fhash size files1 files2")
-"""Files in comparison with identical content hash."""
+ChunkDelta = collections.namedtuple("ChunkDelta", "path size changed_bytes ratio")
+"""Amount of data of a changed file not found in any chunk of the other index."""
 
 
-class Comparison(Storage):
+class ComparisonResult(abc.ABC):
+    """Result of comparing two file trees, as consumed by reports."""
+
+    @abc.abstractmethod
+    def iter_missing(self, *, include_updated=False) -> t.Iterable[FileDesc]:
+        """Return files only in tree 1, but not in 2."""
+
+    @abc.abstractmethod
+    def iter_new(self, *, include_updated=False) -> t.Iterable[FileDesc]:
+        """Return files only in tree 2, but not in 1."""
+
+    @abc.abstractmethod
+    def iter_updated(self) -> t.Iterable[FileDesc]:
+        """Return files that have an identical path but different content."""
+
+    @abc.abstractmethod
+    def iter_content_groups(self) -> t.Iterable[FilesMap]:
+        """Return groups of paths in tree 1 and tree 2 that have identical content."""
+
+    @abc.abstractmethod
+    def iter_hardlink_groups(self, table_suffix: str) -> t.Iterable[LinkGroup]:
+        """Return groups of paths in tree 1 or 2 that are hard links to the same file."""
+
+    def iter_chunk_deltas(self) -> t.Iterable[ChunkDelta]:
+        """Return changed data of files in tree 2 that are not identical in tree 1.
+
+        Only available for files indexed by chunks, by default nothing is returned.
+        """
+        return iter(())
+
+    def open(self):
+        return self
+
+    def close(self):
+        pass
+
+    @abc.abstractmethod
+    def get_meta(self, key: str) -> t.Optional[str]:
+        """Return meta data of comparison, like its creation time."""
+
+    @abc.abstractmethod
+    def get_index_meta(self, key: str, table_suffix: str) -> t.Optional[str]:
+        """Return meta data of tree 1 or 2, like its root directory."""
+
+    def get_index_roots(self, table_suffix: str) -> t.List[str]:
+        """Return resolved root directories of tree 1 or 2."""
+        roots = self.get_index_meta(META_ROOTS, table_suffix)
+        if roots:
+            return roots.split("\n")
+
+        # indices of older versions have a single root:
+        return [self.get_index_meta(META_ROOT_RESOLVED, table_suffix)]
+
+    def report_raw(self):
+        click.echo()
+        click.secho("Missing files:", underline=True, bold=True, fg="bright_cyan")
+        click.echo("\n".join(f.path for f in self.iter_missing()))
+
+        click.echo()
+        click.secho("New files:", underline=True, bold=True, fg="bright_cyan")
+        click.echo("\n".join(f.path for f in self.iter_new()))
+
+        click.echo()
+        click.secho("Updated files:", underline=True, bold=True, fg="bright_cyan")
+        click.echo("\n".join(f.path for f in self.iter_updated()))
+
+        click.echo()
+        click.secho("Identical files:", underline=True, bold=True, fg="bright_cyan")
+        num_groups = sum(1 for _ in self.iter_content_groups())
+        click.echo(f"{num_groups} groups with identical content in both indices.")
+
+        deltas = list(self.iter_chunk_deltas())
+        if deltas:
+            click.echo()
+            click.secho("Changed data:", underline=True, bold=True, fg="bright_cyan")
+            click.echo(
+                "\n".join(f"{d.ratio:7.1%} {d.changed_bytes:>15} {d.path}" for d in deltas)
+            )
+
+
+class Comparison(Storage, ComparisonResult):
     """Comparison of two index databases."""
 
     def create(self, index1: Index, index2: Index):
@@ -103,14 +531,150 @@ class Comparison(Storage):
             self._add_index(index2, "2")
 
     def _add_index(self, index: Index, table_suffix: str):
-        for file in tqdm.tqdm(index.iter_all(), total=index.count(), unit="files"):
-            self._add_file(file, f"file{table_suffix}")
+        for file, fileid in tqdm.tqdm(index.iter_files(), total=index.count(), unit="files"):
+            self._add_file(file, fileid, f"file{table_suffix}")
+            self._on_update()
+
+        for path, chunk in index.iter_chunks():
+            self.connection.execute(
+                f"INSERT INTO chunk{table_suffix} (path,offset,size,hash) VALUES (?,?,?,?);",
+                (path, *chunk),
+            )
             self._on_update()
 
-        # copy meta data of index:
+        self._copy_index_meta(index, table_suffix)
+
+    def _copy_index_meta(self, index: Index, table_suffix: str):
+        self.connection.execute(
+            "DELETE FROM meta WHERE key LIKE ?;", (self._index_key("%", table_suffix),)
+        )
+
         for key, value in index.iter_meta():
             self._put_meta(self._index_key(key, table_suffix), value)
 
+        # indices of older versions have no stored fingerprint:
+        self._set_meta(self._index_key(META_FINGERPRINT, table_suffix), index.fingerprint())
+
+    def update(self, index1: Index, index2: Index) -> bool:
+        """Update existing comparison to current state of given indices.
+
+        Only indices with changed fingerprint are processed, by replacing just their file entries
+        that differ from the comparison. Returns whether the comparison was changed.
+
+        Comparisons created by older versions lack file identities and chunks and cannot be
+        updated, they need to be recreated.
+        """
+        changed = False
+
+        with opened_storage(self):
+            if not all(
+                self._has_column(f"file{suffix}", "device") and self._has_table(f"chunk{suffix}")
+                for suffix in "12"
+            ):
+                raise DbVersionError(self.path)
+
+            for index, table_suffix in ((index1, "1"), (index2, "2")):
+                fingerprint = self.get_index_meta(META_FINGERPRINT, table_suffix)
+                if fingerprint and fingerprint == index.fingerprint():
+                    _logger.info(f"Comparison up to date with {index.path}.")
+                    continue
+
+                click.echo(f"\nUpdating data from {index.path}.")
+                self._update_index(index, table_suffix)
+                changed = True
+
+            if changed:
+                self._set_meta(META_UPDATED, datetime.datetime.now().isoformat())
+
+        return changed
+
+    def _update_index(self, index: Index, table_suffix: str):
+        table = f"file{table_suffix}"
+        columns = "path,size,hash,created,modified,device,inode,links"
+
+        self._flush()
+        self.connection.execute("ATTACH DATABASE ? AS source;", (str(index.path),))
+        try:
+            source_file, source_chunk = self._source_tables(index)
+
+            # remove entries no longer in index, then add entries of index not yet contained:
+            deleted = self.connection.execute(
+                f"DELETE FROM {table} WHERE NOT EXISTS ("
+                f"  SELECT 1 FROM {source_file} AS f WHERE f.path = {table}.path"
+                f"  AND f.size = {table}.size AND f.hash = {table}.hash"
+                f"  AND f.created IS {table}.created AND f.modified IS {table}.modified"
+                f"  AND f.device IS {table}.device AND f.inode IS {table}.inode"
+                f"  AND f.links IS {table}.links"
+                f");"
+            ).rowcount
+            inserted = self.connection.execute(
+                f"INSERT INTO {table} ({columns}) SELECT {columns} FROM {source_file} AS f "
+                f"WHERE NOT EXISTS (SELECT 1 FROM {table} WHERE {table}.path = f.path);"
+            ).rowcount
+            _logger.info(f"Removed {deleted} and added {inserted} entries of {index.path}.")
+
+            chunk_table = f"chunk{table_suffix}"
+            self.connection.execute(
+                f"DELETE FROM {chunk_table} WHERE NOT EXISTS ("
+                f"  SELECT 1 FROM {source_chunk} AS c WHERE c.path = {chunk_table}.path"
+                f"  AND c.offset = {chunk_table}.offset AND c.size = {chunk_table}.size"
+                f"  AND c.hash = {chunk_table}.hash"
+                f");"
+            )
+            self.connection.execute(
+                f"INSERT INTO {chunk_table} (path,offset,size,hash) "
+                f"SELECT path,offset,size,hash FROM {source_chunk} AS c WHERE NOT EXISTS ("
+                f"  SELECT 1 FROM {chunk_table}"
+                f"  WHERE {chunk_table}.path = c.path AND {chunk_table}.offset = c.offset"
+                f");"
+            )
+
+            self._copy_index_meta(index, table_suffix)
+            self._flush()
+        except sqlite3.OperationalError:
+            # index of older version, without file identities or chunks:
+            self.connection.rollback()
+            self._reload_index(index, table_suffix)
+        finally:
+            for temp_table in ("source_file", "source_chunk"):
+                self.connection.execute(f"DROP TABLE IF EXISTS temp.{temp_table};")
+            self.connection.execute("DETACH DATABASE source;")
+
+    def _source_tables(self, index: Index) -> t.Tuple[str, str]:
+        """Return names of file and chunk table of attached index, with paths as read from it.
+
+        Paths of indices with several roots are qualified, so they are copied to temporary tables
+        to be looked up by path.
+        """
+        path, params = index.path_column()
+        if not params:
+            return "source.file", "source.chunk"
+
+        _logger.debug(f"Qualifying paths of {index.path}.")
+        self.connection.execute(
+            f"CREATE TEMP TABLE source_file AS "
+            f"SELECT {path} AS path,size,hash,created,modified,device,inode,links "
+            f"FROM source.file;",
+            params,
+        )
+        self.connection.execute("CREATE INDEX temp.idx_source_file ON source_file (path);")
+        self.connection.execute(
+            f"CREATE TEMP TABLE source_chunk AS "
+            f"SELECT {path} AS path,offset,size,hash FROM source.chunk;",
+            params,
+        )
+        self.connection.execute(
+            "CREATE INDEX temp.idx_source_chunk ON source_chunk (path,offset);"
+        )
+        return "temp.source_file", "temp.source_chunk"
+
+    def _reload_index(self, index: Index, table_suffix: str):
+        _logger.warning(f"Cannot update incrementally, reloading {index.path}.")
+        self.connection.execute(f"DELETE FROM file{table_suffix};")
+        self.connection.execute(f"DELETE FROM chunk{table_suffix};")
+        self._add_index(index, table_suffix)
+        self._flush()
+
     @staticmethod
     def _index_key(key: str, table_suffix: str) -> str:
         return f"INDEX{table_suffix}_{key}"
@@ -118,12 +682,12 @@ class Comparison(Storage):
     def get_index_meta(self, key: str, table_suffix: str) -> t.Optional[str]:
         return self.get_meta(self._index_key(key, table_suffix))
 
-    def _add_file(self, filedesc: FileDesc, table: str):
+    def _add_file(self, filedesc: FileDesc, fileid: FileId, table: str):
         try:
             self.connection.execute(
-                f"INSERT INTO {table} (path,size,hash,created,modified)"
-                f"  VALUES (?,?,?,datetime(?),datetime(?));",
-                filedesc,
+                f"INSERT INTO {table} (path,size,hash,created,modified,device,inode,links)"
+                f"  VALUES (?,?,?,datetime(?),datetime(?),?,?,?);",
+                (*filedesc, *fileid),
             )
         except sqlite3.OperationalError:
             _logger.error(f"Cannot add file to database: {filedesc}")
@@ -196,13 +760,17 @@ class Comparison(Storage):
         pairs' elements.
         """
         with opened_storage(self):
+            copies1, copies2 = (self._file_identity(f"file{suffix}") for suffix in "12")
+
             with contextlib.closing(self.connection.cursor()) as cursor:
                 for row in cursor.execute(
                     "SELECT "
                     "  file1.hash,"
                     "  file1.size,"
                     "  group_concat(DISTINCT file1.path) AS files1,"
-                    "  group_concat(DISTINCT file2.path) AS files2 "
+                    "  group_concat(DISTINCT file2.path) AS files2,"
+                    f"  COUNT(DISTINCT {copies1}),"
+                    f"  COUNT(DISTINCT {copies2}) "
                     "FROM file1 JOIN file2 "
                     "  ON file1.hash == file2.hash "
                     "GROUP BY file1.hash,file1.size "
@@ -215,20 +783,66 @@ class Comparison(Storage):
                         files1=fmap.files1.split(","), files2=fmap.files2.split(",")
                     )
 
-    def report_raw(self):
-        click.echo()
-        click.secho("Missing files:", underline=True, bold=True, fg="bright_cyan")
-        click.echo("\n".join(f.path for f in self.iter_missing()))
+    def _file_identity(self, table: str) -> str:
+        """Returns expression identifying file on disk, older comparisons only have paths."""
+        if not self._has_column(table, "device"):
+            return f"{table}.path"
+        return f"coalesce({table}.device || ':' || {table}.inode, {table}.path)"
 
-        click.echo()
-        click.secho("New files:", underline=True, bold=True, fg="bright_cyan")
-        click.echo("\n".join(f.path for f in self.iter_new()))
+    def iter_hardlink_groups(self, table_suffix: str):
+        """Return groups of paths in index 1 or 2 that are hard links to the same file."""
+        table = f"file{table_suffix}"
 
-        click.echo()
-        click.secho("Updated files:", underline=True, bold=True, fg="bright_cyan")
-        click.echo("\n".join(f.path for f in self.iter_updated()))
+        with opened_storage(self):
+            if not self._has_column(table, "inode"):
+                return
 
-        click.echo()
-        click.secho("Identical files:", underline=True, bold=True, fg="bright_cyan")
-        num_groups = sum(1 for _ in self.iter_content_groups())
-        click.echo(f"{num_groups} groups with identical content in both indices.")
+            with contextlib.closing(self.connection.cursor()) as cursor:
+                for row in cursor.execute(
+                    f"SELECT "
+                    f"  min(hash),"
+                    f"  min(size),"
+                    f"  group_concat(path) AS files "
+                    f"FROM {table} "
+                    f"WHERE inode IS NOT NULL "
+                    f"GROUP BY device,inode "
+                    f"HAVING COUNT(*) > 1 "
+                    f"ORDER BY files"
+                ):
+                    group = LinkGroup._make(row)
+                    yield group._replace(files=sorted(group.files.split(",")))
+
+    def iter_chunk_deltas(self):
+        """Return changed data of files in index 2 that are not identical in index 1.
+
+        Data of a file counts as changed if a chunk is not found in any file of index 1, so data
+        moved between files is not counted.
+        """
+        with opened_storage(self):
+            if not self._has_table("chunk2"):
+                # comparison of older version:
+                return
+
+            with contextlib.closing(self.connection.cursor()) as cursor:
+                for path, size, changed_bytes in cursor.execute(
+                    "SELECT "
+                    "  file2.path,"
+                    "  file2.size,"
+                    "  SUM(CASE WHEN EXISTS ("
+                    "    SELECT 1 FROM chunk1 WHERE chunk1.hash = chunk2.hash"
+                    "  ) THEN 0 ELSE chunk2.size END) "
+                    "FROM file2 JOIN chunk2 "
+                    "  ON file2.path = chunk2.path "
+                    "WHERE NOT EXISTS ("
+                    "  SELECT 1 FROM file1"
+                    "  WHERE file1.path = file2.path AND file1.hash = file2.hash"
+                    ") "
+                    "GROUP BY file2.path "
+                    "ORDER BY file2.path"
+                ):
+                    yield ChunkDelta(
+                        path=path,
+                        size=size,
+                        changed_bytes=changed_bytes,
+                        ratio=changed_bytes / size if size else 0.0,
+                    )
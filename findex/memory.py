@@ -0,0 +1,234 @@
+"""In-memory comparison of indices based on numpy arrays."""
+import datetime
+import logging
+import typing as t
+
+import click
+import numpy as np
+
+import findex
+from findex.db import META_CREATED, META_VERSION
+from findex.fs import Chunk, FileDesc, FileId
+from findex.index import ChunkDelta, ComparisonResult, FilesMap, Index, LinkGroup
+
+_logger = logging.getLogger(__name__)
+
+
+class IndexArrays:
+    """Columnar copy of an index, with paths interned to ids shared between indices.
+
+    Files on disk are interned to ids as well, so hard links to the same file share an id. Chunks
+    of files indexed by chunks are kept in separate columns.
+    """
+
+    def __init__(
+        self,
+        files: t.List[t.Tuple[FileDesc, FileId]],
+        chunks: t.List[t.Tuple[str, Chunk]],
+        path_ids: t.Dict[str, int],
+        meta: t.Dict[str, str],
+    ):
+        keys = [(i.device, i.inode) if i.inode is not None else f.path for f, i in files]
+        disk_ids = {}
+
+        self.meta = meta
+        self.disk_ids = np.array(
+            [disk_ids.setdefault(key, len(disk_ids)) for key in keys], dtype=np.int64
+        )
+        files = [f for f, _ in files]
+        self.path_ids = np.array([path_ids[f.path] for f in files], dtype=np.int64)
+        self.hashes = np.array([f.fhash.encode() for f in files], dtype=np.bytes_)
+        self.sizes = np.array([f.size for f in files], dtype=np.int64)
+        self.created = np.array([f.created for f in files], dtype="datetime64[s]")
+        self.modified = np.array([f.modified for f in files], dtype="datetime64[s]")
+
+        self.chunk_path_ids = np.array([path_ids[path] for path, _ in chunks], dtype=np.int64)
+        self.chunk_hashes = np.array([c.fhash.encode() for _, c in chunks], dtype=np.bytes_)
+        self.chunk_sizes = np.array([c.size for _, c in chunks], dtype=np.int64)
+
+        # rows are kept sorted by path:
+        order = np.argsort(self.path_ids, kind="stable")
+        for name in ("path_ids", "disk_ids", "hashes", "sizes", "created", "modified"):
+            setattr(self, name, getattr(self, name)[order])
+
+
+class MemoryComparison(ComparisonResult):
+    """Comparison of two indices computed in memory, without creating a database."""
+
+    def __init__(self):
+        self.created = None
+        self.paths: t.List[str] = []
+        self.arrays1: t.Optional[IndexArrays] = None
+        self.arrays2: t.Optional[IndexArrays] = None
+
+    def create(self, index1: Index, index2: Index):
+        """Load both indices into memory."""
+        _logger.info(f"Comparing {index1.path} and {index2.path} in memory.")
+        self.created = datetime.datetime.now()
+
+        click.echo(f"Loading data from {index1.path}.")
+        files1 = list(index1.iter_files())
+        chunks1 = list(index1.iter_chunks())
+        click.echo(f"Loading data from {index2.path}.")
+        files2 = list(index2.iter_files())
+        chunks2 = list(index2.iter_chunks())
+
+        # ids are assigned in path order, so sorting by id sorts by path:
+        self.paths = sorted({f.path for f, _ in files1} | {f.path for f, _ in files2})
+        path_ids = {path: path_id for path_id, path in enumerate(self.paths)}
+
+        self.arrays1 = IndexArrays(files1, chunks1, path_ids, dict(index1.iter_meta()))
+        self.arrays2 = IndexArrays(files2, chunks2, path_ids, dict(index2.iter_meta()))
+
+        return self
+
+    def _arrays(self, table_suffix: str) -> IndexArrays:
+        return self.arrays1 if table_suffix == "1" else self.arrays2
+
+    def _file(self, arrays: IndexArrays, row: int) -> FileDesc:
+        return FileDesc(
+            path=self.paths[arrays.path_ids[row]],
+            size=int(arrays.sizes[row]),
+            fhash=arrays.hashes[row].decode(),
+            created=arrays.created[row].item(),
+            modified=arrays.modified[row].item(),
+        )
+
+    def _updated_rows(self) -> t.Tuple[np.ndarray, np.ndarray]:
+        """Return rows in index 1 and index 2 with identical path but different hashes."""
+        _, rows1, rows2 = np.intersect1d(
+            self.arrays1.path_ids,
+            self.arrays2.path_ids,
+            assume_unique=True,
+            return_indices=True,
+        )
+        changed = self.arrays1.hashes[rows1] != self.arrays2.hashes[rows2]
+        return rows1[changed], rows2[changed]
+
+    def _iter_exclusive_files(self, contained, not_contained, *, include_updated=False):
+        """Return files only in contained, but not in not_contained."""
+        mask = ~np.isin(contained.hashes, not_contained.hashes)
+
+        if not include_updated:
+            rows1, _ = self._updated_rows()
+            mask &= ~np.isin(contained.path_ids, self.arrays1.path_ids[rows1])
+
+        for row in np.flatnonzero(mask):
+            yield self._file(contained, row)
+
+    def iter_missing(self, *, include_updated=False):
+        """Return files only in index 1, but not in 2."""
+        return self._iter_exclusive_files(
+            self.arrays1, self.arrays2, include_updated=include_updated
+        )
+
+    def iter_new(self, *, include_updated=False):
+        """Return files only in index 2, but not in 1."""
+        return self._iter_exclusive_files(
+            self.arrays2, self.arrays1, include_updated=include_updated
+        )
+
+    def iter_updated(self):
+        """Return files that have an identical path but different hashes."""
+        rows1, _ = self._updated_rows()
+        for row in rows1:
+            yield self._file(self.arrays1, row)
+
+    @staticmethod
+    def _group_rows(arrays: IndexArrays, hashes: np.ndarray) -> t.List[np.ndarray]:
+        """Return rows sorted by path for each of the given sorted, unique hashes."""
+        rows = np.flatnonzero(np.isin(arrays.hashes, hashes))
+        rows = rows[np.argsort(arrays.hashes[rows], kind="stable")]
+        bounds = np.searchsorted(arrays.hashes[rows], hashes, side="right")
+        return np.split(rows, bounds[:-1])
+
+    def _paths(self, arrays: IndexArrays, rows: np.ndarray) -> t.List[str]:
+        return [self.paths[path_id] for path_id in arrays.path_ids[rows]]
+
+    def iter_content_groups(self):
+        """Return list of pairs of paths in index 1 and index 2 that have identical content."""
+        hashes, rows1, _ = np.intersect1d(
+            self.arrays1.hashes, self.arrays2.hashes, return_indices=True
+        )
+        groups = [
+            FilesMap(
+                fhash=fhash.decode(),
+                size=int(size),
+                files1=self._paths(self.arrays1, group_rows1),
+                files2=self._paths(self.arrays2, group_rows2),
+                copies1=len(np.unique(self.arrays1.disk_ids[group_rows1])),
+                copies2=len(np.unique(self.arrays2.disk_ids[group_rows2])),
+            )
+            for fhash, size, group_rows1, group_rows2 in zip(
+                hashes,
+                self.arrays1.sizes[rows1],
+                self._group_rows(self.arrays1, hashes),
+                self._group_rows(self.arrays2, hashes),
+            )
+        ]
+        yield from sorted(groups, key=lambda g: ",".join(g.files1))
+
+    def iter_hardlink_groups(self, table_suffix: str):
+        """Return groups of paths in index 1 or 2 that are hard links to the same file."""
+        arrays = self._arrays(table_suffix)
+        disk_ids, counts = np.unique(arrays.disk_ids, return_counts=True)
+        linked_ids = disk_ids[counts > 1]
+
+        rows = np.flatnonzero(np.isin(arrays.disk_ids, linked_ids))
+        rows = rows[np.argsort(arrays.disk_ids[rows], kind="stable")]
+        bounds = np.searchsorted(arrays.disk_ids[rows], linked_ids, side="right")
+
+        groups = [
+            LinkGroup(
+                fhash=arrays.hashes[group_rows[0]].decode(),
+                size=int(arrays.sizes[group_rows[0]]),
+                files=self._paths(arrays, group_rows),
+            )
+            for group_rows in np.split(rows, bounds[:-1])
+            if len(group_rows)
+        ]
+        yield from sorted(groups, key=lambda g: ",".join(g.files))
+
+    def iter_chunk_deltas(self):
+        """Return changed data of files in index 2 that are not identical in index 1.
+
+        Data of a file counts as changed if a chunk is not found in any file of index 1, so data
+        moved between files is not counted.
+        """
+        arrays1, arrays2 = self.arrays1, self.arrays2
+
+        _, rows1, rows2 = np.intersect1d(
+            arrays1.path_ids, arrays2.path_ids, assume_unique=True, return_indices=True
+        )
+        identical = arrays2.path_ids[rows2[arrays1.hashes[rows1] == arrays2.hashes[rows2]]]
+
+        rows = ~np.isin(arrays2.chunk_path_ids, identical)
+        changed_sizes = np.where(
+            np.isin(arrays2.chunk_hashes[rows], arrays1.chunk_hashes),
+            0,
+            arrays2.chunk_sizes[rows],
+        )
+
+        # chunks summed per file, in path order:
+        path_ids, inverse = np.unique(arrays2.chunk_path_ids[rows], return_inverse=True)
+        changed_bytes = np.zeros(len(path_ids), dtype=np.int64)
+        np.add.at(changed_bytes, inverse, changed_sizes)
+        sizes = arrays2.sizes[np.searchsorted(arrays2.path_ids, path_ids)]
+
+        for path_id, size, changed in zip(path_ids, sizes, changed_bytes):
+            yield ChunkDelta(
+                path=self.paths[path_id],
+                size=int(size),
+                changed_bytes=int(changed),
+                ratio=int(changed) / int(size) if size else 0.0,
+            )
+
+    def get_meta(self, key: str) -> t.Optional[str]:
+        if key == META_CREATED:
+            return self.created.isoformat()
+        if key == META_VERSION:
+            return findex.__version__
+        return None
+
+    def get_index_meta(self, key: str, table_suffix: str) -> t.Optional[str]:
+        return self._arrays(table_suffix).meta.get(key)
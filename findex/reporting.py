@@ -10,7 +10,7 @@ import xlsxwriter
 
 from findex.db import META_CREATED, META_VERSION
 from findex.fs import FileDesc
-from findex.index import Comparison, META_ROOT_RESOLVED
+from findex.index import ComparisonResult
 
 _logger = logging.getLogger(__name__)
 
@@ -19,10 +19,11 @@ COL_WIDTH_SIZE = 15
 COL_WIDTH_DATE = 25
 COL_WIDTH_COUNT = 10
 COL_WIDTH_HASH = 50
+COL_WIDTH_RATIO = 15
 
 
 class ComparisonReport:
-    def __init__(self, comparison: Comparison):
+    def __init__(self, comparison: ComparisonResult):
         self.comparison = comparison
 
         self.workbook = None
@@ -47,6 +48,7 @@ class ComparisonReport:
                 ),
                 "textlist": workbook.add_format({"text_wrap": True, "valign": "top"}),
                 "number": workbook.add_format({"num_format": 0x01, "valign": "top"}),
+                "percent": workbook.add_format({"num_format": 0x0A, "valign": "top"}),
                 "header": workbook.add_format({"font_size": 20, "bold": True}),
                 "summary_key": workbook.add_format({"align": "right", "bold": True}),
                 "summary_value": workbook.add_format({"align": "left"}),
@@ -64,6 +66,7 @@ class ComparisonReport:
                 "New Files", self.comparison.iter_new()
             )
             moved_groups = self._write_moved_files_worksheet("Moved Files")
+            self._write_changed_data_worksheet("Changed Data")
 
             self._write_summary_worksheet(
                 summary_worksheet,
@@ -120,9 +123,9 @@ class ComparisonReport:
         )
         data = [
             (
-                len(g.files1),
+                g.copies1,
                 "\n".join(g.files1),
-                len(g.files2),
+                g.copies2,
                 "\n".join(g.files2),
                 g.size,
                 g.fhash,
@@ -173,6 +176,46 @@ class ComparisonReport:
 
         return len(data)
 
+    def _write_changed_data_worksheet(self, worksheet_name: str):
+        data = [
+            (d.path, d.size, d.changed_bytes, d.ratio)
+            for d in self.comparison.iter_chunk_deltas()
+        ]
+
+        if not data:
+            _logger.debug(f"Skipping worksheet {worksheet_name!r}, no files indexed by chunks.")
+            return 0
+
+        click.secho(
+            f"\nCreating worksheet {worksheet_name!r}.", bold=True, fg="bright_cyan"
+        )
+        click.echo(f"{worksheet_name!r} has {len(data)} entries.")
+
+        worksheet = self.workbook.add_worksheet(worksheet_name)
+
+        worksheet.set_column(0, 0, width=COL_WIDTH_PATH)
+        worksheet.set_column(1, 2, width=COL_WIDTH_SIZE)
+        worksheet.set_column(3, 3, width=COL_WIDTH_RATIO)
+
+        worksheet.add_table(
+            0,
+            0,
+            len(data),
+            3,
+            {
+                "style": "Table Style Light 18",
+                "data": data,
+                "columns": [
+                    {"header": "Path (Index 2)", "format": self.formats["textlist"]},
+                    {"header": "Size (Bytes)", "format": self.formats["number"]},
+                    {"header": "Changed (Bytes)", "format": self.formats["number"]},
+                    {"header": "Changed (Ratio)", "format": self.formats["percent"]},
+                ],
+            },
+        )
+
+        return len(data)
+
     def _write_summary_worksheet(
         self,
         worksheet,
@@ -210,12 +253,12 @@ class ComparisonReport:
                 ["Comparison:", self.comparison.get_meta(META_VERSION), created],
                 [
                     "Index 1:",
-                    self.comparison.get_index_meta(META_ROOT_RESOLVED, "1"),
+                    "\n".join(self.comparison.get_index_roots("1")),
                     created1,
                 ],
                 [
                     "Index 2:",
-                    self.comparison.get_index_meta(META_ROOT_RESOLVED, "2"),
+                    "\n".join(self.comparison.get_index_roots("2")),
                     created2,
                 ],
                 ["", "", ""],
@@ -3,7 +3,10 @@ CREATE TABLE file1 (
     size INTEGER NOT NULL,
     hash TEXT NOT NULL,
     created TIMESTAMP NULL,
-    modified TIMESTAMP NULL
+    modified TIMESTAMP NULL,
+    device INTEGER NULL,
+    inode INTEGER NULL,
+    links INTEGER NULL
 );
 
 CREATE TABLE file2 (
@@ -11,10 +14,34 @@ CREATE TABLE file2 (
     size INTEGER NOT NULL,
     hash TEXT NOT NULL,
     created TIMESTAMP NULL,
-    modified TIMESTAMP NULL
+    modified TIMESTAMP NULL,
+    device INTEGER NULL,
+    inode INTEGER NULL,
+    links INTEGER NULL
 );
 
 CREATE INDEX idx_hash1 ON file1 (hash);
 CREATE INDEX idx_path1 ON file1 (path);
 CREATE INDEX idx_hash2 ON file2 (hash);
 CREATE INDEX idx_path2 ON file2 (path);
+CREATE INDEX idx_inode1 ON file1 (device, inode);
+CREATE INDEX idx_inode2 ON file2 (device, inode);
+
+CREATE TABLE chunk1 (
+    path TEXT NOT NULL,
+    offset INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    hash TEXT NOT NULL,
+    PRIMARY KEY (path, offset)
+);
+
+CREATE TABLE chunk2 (
+    path TEXT NOT NULL,
+    offset INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    hash TEXT NOT NULL,
+    PRIMARY KEY (path, offset)
+);
+
+CREATE INDEX idx_chunk_hash1 ON chunk1 (hash);
+CREATE INDEX idx_chunk_hash2 ON chunk2 (hash);
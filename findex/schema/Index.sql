@@ -1,9 +1,34 @@
+CREATE TABLE root (
+    id INTEGER PRIMARY KEY,
+    specified TEXT NOT NULL,
+    resolved TEXT NOT NULL UNIQUE,
+    added TIMESTAMP NOT NULL
+);
+
 CREATE TABLE file (
-    path TEXT PRIMARY KEY,
+    root INTEGER NOT NULL REFERENCES root (id),
+    path TEXT NOT NULL,
     size INTEGER NOT NULL,
     hash TEXT NOT NULL,
     created TIMESTAMP NULL,
-    modified TIMESTAMP NULL
+    modified TIMESTAMP NULL,
+    device INTEGER NULL,
+    inode INTEGER NULL,
+    links INTEGER NULL,
+    PRIMARY KEY (root, path)
 );
 
 CREATE INDEX idx_hash ON file (hash);
+CREATE INDEX idx_path ON file (path);
+CREATE INDEX idx_root_hash ON file (root, hash);
+
+CREATE TABLE chunk (
+    root INTEGER NOT NULL REFERENCES root (id),
+    path TEXT NOT NULL,
+    offset INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    hash TEXT NOT NULL,
+    PRIMARY KEY (root, path, offset)
+);
+
+CREATE INDEX idx_chunk_hash ON chunk (hash);
@@ -0,0 +1,314 @@
+"""Query service keeping index and comparison databases in memory."""
+import collections
+import contextlib
+import http.server
+import json
+import logging
+import os
+import pathlib
+import socketserver
+import sqlite3
+import threading
+import typing as t
+import urllib.parse
+
+from findex.db import Storage
+from findex.index import Comparison, Index
+
+DEFAULT_MEMORY_LIMIT = 1024 * 1024 * 1024
+"""Default maximum number of bytes of databases kept in memory."""
+
+_logger = logging.getLogger(__name__)
+
+
+class UnknownDatabaseError(Exception):
+    """The requested database is not served."""
+
+
+class UnavailableDatabaseError(Exception):
+    """The requested database is temporarily not available, e.g. while it is recreated."""
+
+
+class QueryError(Exception):
+    """The query is invalid."""
+
+
+class LoadedDatabase:
+    """Database in memory, with the lock serializing queries to its connection.
+
+    Users are counted, so an evicted database is closed by the last of them.
+    """
+
+    def __init__(self, storage: Storage, size: int, stamp: t.Tuple[int, ...]):
+        self.storage = storage
+        self.size = size
+        self.stamp = stamp
+        self.lock = threading.Lock()
+        self.users = 0
+        self.evicted = False
+
+
+class DatabaseCache:
+    """Databases loaded into memory on demand, evicting the least recently used ones.
+
+    A database is reloaded when its file has changed on disk since it was loaded. While the file is
+    missing, e.g. while recreated, an already loaded copy is still served.
+
+    The cache lock guards the bookkeeping of loaded databases only. Databases are loaded under a
+    lock per name and queried under a lock per loaded database, so loading or querying one
+    database does not block queries to others.
+    """
+
+    def __init__(self, memory_limit: int = DEFAULT_MEMORY_LIMIT):
+        self.memory_limit = memory_limit
+        self.sources: t.Dict[str, t.Tuple[t.Type[Storage], pathlib.Path]] = {}
+        self.loaded: t.OrderedDict[str, LoadedDatabase] = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.load_locks: t.Dict[str, threading.Lock] = {}
+
+    def register(self, name: str, storage_class: t.Type[Storage], path: pathlib.Path):
+        if name in self.sources:
+            raise ValueError(f"Database name {name!r} is not unique.")
+        self.sources[name] = storage_class, path
+        self.load_locks[name] = threading.Lock()
+
+    @property
+    def memory_used(self) -> int:
+        return sum(loaded.size for loaded in self.loaded.values())
+
+    @contextlib.contextmanager
+    def use(self, name: str) -> t.Iterator[Storage]:
+        """Return in-memory storage of given name for exclusive use, loading it if needed."""
+        loaded = self._acquire(name)
+        try:
+            with loaded.lock:
+                yield loaded.storage
+        finally:
+            self._release(loaded)
+
+    def _acquire(self, name: str) -> LoadedDatabase:
+        try:
+            storage_class, path = self.sources[name]
+        except KeyError:
+            raise UnknownDatabaseError(name)
+
+        with self.load_locks[name]:
+            stamp = _file_stamp(path)
+
+            with self.lock:
+                loaded = self.loaded.get(name)
+                if loaded and (loaded.stamp == stamp or not path.exists()):
+                    self.loaded.move_to_end(name)
+                    loaded.users += 1
+                    return loaded
+
+            if loaded:
+                _logger.info(f"Database {path} changed on disk, reloading.")
+
+            loaded = LoadedDatabase(self._load(storage_class, path), 0, stamp)
+            loaded.size = _database_size(loaded.storage.connection)
+            loaded.users = 1
+
+            if loaded.size > self.memory_limit:
+                _logger.warning(
+                    f"Database {path} of {loaded.size} bytes exceeds memory limit of "
+                    f"{self.memory_limit} bytes, serving it anyway."
+                )
+
+            with self.lock:
+                evicted = [self.loaded.pop(name)] if name in self.loaded else []
+                self.loaded[name] = loaded
+
+                # evict least recently used databases, except the requested one:
+                while self.memory_used > self.memory_limit and len(self.loaded) > 1:
+                    evicted.append(self.loaded.pop(next(iter(self.loaded))))
+
+                for database in evicted:
+                    database.evicted = True
+                unused = [database for database in evicted if not database.users]
+
+            for database in unused:
+                self._close(database)
+
+            return loaded
+
+    def _release(self, loaded: LoadedDatabase):
+        with self.lock:
+            loaded.users -= 1
+            unused = loaded.evicted and not loaded.users
+
+        if unused:
+            self._close(loaded)
+
+    @staticmethod
+    def _load(storage_class: t.Type[Storage], path: pathlib.Path) -> Storage:
+        _logger.info(f"Loading database {path} into memory.")
+        storage = storage_class(path)
+
+        connection = sqlite3.connect(
+            ":memory:", detect_types=sqlite3.PARSE_DECLTYPES, check_same_thread=False
+        )
+        try:
+            # read-only, so a missing file is not created:
+            source = sqlite3.connect(f"{path.absolute().as_uri()}?mode=ro", uri=True)
+        except sqlite3.OperationalError:
+            connection.close()
+            if not path.exists():
+                raise UnavailableDatabaseError(path)
+            raise
+
+        with contextlib.closing(source):
+            source.backup(connection)
+
+        storage.connection = connection
+        return storage
+
+    @staticmethod
+    def _close(loaded: LoadedDatabase):
+        _logger.info(f"Unloading database {loaded.storage.path}.")
+        loaded.storage.connection.close()
+        loaded.storage.connection = None
+
+
+def _file_stamp(path: pathlib.Path) -> t.Tuple[int, ...]:
+    """Return modification stamp of database, including its write-ahead log, if any."""
+    stamp = ()
+    for filepath in (path, path.with_name(f"{path.name}-wal")):
+        if filepath.exists():
+            stat = filepath.stat()
+            stamp += (stat.st_mtime_ns, stat.st_size)
+    return stamp
+
+
+def _database_size(connection: sqlite3.Connection) -> int:
+    page_count = connection.execute("PRAGMA page_count").fetchone()[0]
+    page_size = connection.execute("PRAGMA page_size").fetchone()[0]
+    return page_count * page_size
+
+
+class QueryHandler(http.server.BaseHTTPRequestHandler):
+    """Answers queries as JSON documents.
+
+    Supported queries are:
+
+    - `/databases`: names of served databases
+    - `/lookup?db=NAME&hash=HASH` or `/lookup?db=NAME&path=PATH`: files in an index
+    - `/compare?db=NAME&result=missing|new|updated|groups`: results of a comparison
+    - `/report?db=NAME`: summary of a comparison
+    """
+
+    cache: DatabaseCache = None
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        params = dict(urllib.parse.parse_qsl(url.query))
+
+        query = getattr(self, f"_query_{url.path.strip('/')}", None)
+        if not query:
+            self._send(404, {"error": f"Unknown query {url.path!r}."})
+            return
+
+        try:
+            result = query(params)
+        except UnknownDatabaseError as ex:
+            self._send(404, {"error": f"Unknown database {ex}."})
+        except UnavailableDatabaseError as ex:
+            self._send(503, {"error": f"Database {ex} is not available, please retry later."})
+        except QueryError as ex:
+            self._send(400, {"error": str(ex)})
+        except (OSError, sqlite3.Error) as ex:
+            _logger.error(f"Query {self.path!r} failed: {ex}")
+            self._send(500, {"error": str(ex)})
+        else:
+            self._send(200, result)
+
+    def _send(self, status: int, data):
+        body = json.dumps(data, default=str).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    @contextlib.contextmanager
+    def _storage(self, params, storage_class: t.Type[Storage]) -> t.Iterator[Storage]:
+        if "db" not in params:
+            raise QueryError("Parameter 'db' is required.")
+
+        with self.cache.use(params["db"]) as storage:
+            if not isinstance(storage, storage_class):
+                raise QueryError(f"Database {params['db']!r} is no {storage_class.__name__}.")
+            yield storage
+
+    def _query_databases(self, params):
+        with self.cache.lock:
+            return [
+                {
+                    "name": name,
+                    "type": storage_class.__name__,
+                    "path": path,
+                    "loaded": name in self.cache.loaded,
+                }
+                for name, (storage_class, path) in self.cache.sources.items()
+            ]
+
+    def _query_lookup(self, params):
+        if "hash" not in params and "path" not in params:
+            raise QueryError("Parameter 'hash' or 'path' is required.")
+
+        with self._storage(params, Index) as index:
+            files = index.lookup(path=params.get("path"), fhash=params.get("hash"))
+        return [f._asdict() for f in files]
+
+    def _query_compare(self, params):
+        result = params.get("result")
+        iter_results = {
+            "missing": Comparison.iter_missing,
+            "new": Comparison.iter_new,
+            "updated": Comparison.iter_updated,
+            "groups": Comparison.iter_content_groups,
+        }
+        if result not in iter_results:
+            raise QueryError("Parameter 'result' must be one of missing, new, updated, groups.")
+
+        with self._storage(params, Comparison) as comparison:
+            return [r._asdict() for r in iter_results[result](comparison)]
+
+    def _query_report(self, params):
+        with self._storage(params, Comparison) as comparison:
+            return {
+                "meta": dict(comparison.iter_meta()),
+                "missing": sum(1 for _ in comparison.iter_missing()),
+                "new": sum(1 for _ in comparison.iter_new()),
+                "updated": sum(1 for _ in comparison.iter_updated()),
+                "groups": sum(1 for _ in comparison.iter_content_groups()),
+            }
+
+    def log_message(self, format, *args):
+        _logger.debug(f"{self.address_string()}: {format % args}")
+
+    def address_string(self):
+        # clients of unix sockets have no address:
+        return str(self.client_address[0]) if self.client_address else "local"
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def create_server(
+    cache: DatabaseCache,
+    *,
+    host: str = "127.0.0.1",
+    port: int = 8642,
+    socket_path: t.Optional[pathlib.Path] = None,
+) -> socketserver.BaseServer:
+    """Create server answering queries, on a unix socket if path given, else via HTTP."""
+    handler = type("Handler", (QueryHandler,), {"cache": cache})
+
+    if socket_path:
+        if socket_path.exists():
+            os.unlink(socket_path)
+        return ThreadingUnixHTTPServer(str(socket_path), handler)
+
+    return http.server.ThreadingHTTPServer((host, port), handler)
@@ -0,0 +1,233 @@
+"""Verification of an index against the live directory tree."""
+import concurrent.futures
+import datetime
+import logging
+import os
+import pathlib
+import random
+import typing as t
+
+import click
+import tqdm
+
+import findex
+from findex.db import META_CREATED, META_VERSION, opened_storage
+from findex.fs import (
+    FILEHASH_EMPTY,
+    FILEHASH_INACCESSIBLE_FILE,
+    FILEHASH_WALK_ERROR,
+    FileDesc,
+    compute_filehash,
+    is_archive,
+    scan,
+)
+from findex.index import (
+    META_ROOT_RESOLVED,
+    META_ROOT_SPECIFIED,
+    META_ROOTS,
+    ComparisonResult,
+    FilesMap,
+    Index,
+    Root,
+)
+
+_logger = logging.getLogger(__name__)
+
+_FILEHASH_WALK_ERROR_PREFIX = FILEHASH_WALK_ERROR.partition("{")[0]
+
+
+class Verification(ComparisonResult):
+    """Verification of an index (tree 1) against the current state of a directory (tree 2).
+
+    Files are matched by path in a single merge pass over the directory and the index, both sorted
+    by path. Changes are detected from size and modification time, in deep mode additionally by
+    rehashing (a sample of) the files that look unchanged.
+    """
+
+    def __init__(self, index: Index, path: pathlib.Path):
+        self.index = index
+        self.path = path
+        self.created = None
+
+        self.missing: t.List[FileDesc] = []
+        self.new: t.List[FileDesc] = []
+        self.updated: t.List[t.Tuple[FileDesc, FileDesc]] = []
+
+    def run(self, *, deep=False, sample=1.0, workers=None):
+        """Verify directory against index.
+
+        In deep mode, a fraction `sample` of the files unchanged in size and modification time are
+        rehashed by `workers` threads, to detect silent content changes like bit rot.
+        """
+        _logger.info(f"Verifying {self.path} against {self.index.path}.")
+        self.created = datetime.datetime.now()
+        self.missing, self.new, self.updated = [], [], []
+        unchanged = []
+
+        click.echo(f"Verifying {self.path}...")
+        for indexed, live in tqdm.tqdm(self._merge(), unit="files"):
+            if live is None:
+                self.missing.append(indexed)
+            elif indexed is None:
+                self.new.append(live)
+            elif (indexed.size, indexed.modified) != (live.size, live.modified):
+                self.updated.append((indexed, live))
+            elif deep and live.size > 0:
+                unchanged.append((indexed, live))
+
+        if deep:
+            self._rehash(unchanged, sample=sample, workers=workers)
+
+    def _merge(self) -> t.Iterable[t.Tuple[t.Optional[FileDesc], t.Optional[FileDesc]]]:
+        """Return pairs of indexed and live file, with None for the side a path is missing in."""
+        indexed_files = iter(self._iter_indexed())
+        live_files = iter(self._iter_live())
+
+        indexed = next(indexed_files, None)
+        live = next(live_files, None)
+
+        while indexed is not None or live is not None:
+            if live is None or (indexed is not None and indexed.path < live.path):
+                yield indexed, None
+                indexed = next(indexed_files, None)
+            elif indexed is None or live.path < indexed.path:
+                yield None, live
+                live = next(live_files, None)
+            else:
+                yield indexed, live
+                indexed = next(indexed_files, None)
+                live = next(live_files, None)
+
+    def _iter_indexed(self) -> t.Iterable[FileDesc]:
+        root = self.index.find_root(str(self.path))
+        if root is None and len(self.index.roots()) > 1:
+            raise ValueError(f"{self.path} is no root of index {self.index.path}.")
+
+        # members of archives indexed as files are verified by their archive only:
+        archives = set()
+
+        for file in self.index.iter_all(ordered=True, root=root):
+            if file.fhash.startswith(_FILEHASH_WALK_ERROR_PREFIX):
+                continue
+            if archives and self._in_archive(file.path, archives):
+                continue
+            if is_archive(file.path):
+                archives.add(file.path)
+
+            yield file
+
+    @staticmethod
+    def _in_archive(path: str, archives: t.Set[str]) -> bool:
+        parent = os.path.dirname(path)
+        while parent:
+            if parent in archives:
+                return True
+            parent = os.path.dirname(parent)
+        return False
+
+    def _iter_live(self) -> t.Iterable[FileDesc]:
+        def _timestamp(seconds: float) -> datetime.datetime:
+            # index stores timestamps with a resolution of seconds:
+            return datetime.datetime.fromtimestamp(seconds).replace(microsecond=0)
+
+        for path, stat in scan(self.path):
+            yield FileDesc(
+                path=path,
+                size=stat.st_size,
+                fhash=None,
+                created=_timestamp(stat.st_ctime),
+                modified=_timestamp(stat.st_mtime),
+            )
+
+    def _rehash(self, files, *, sample: float, workers: t.Optional[int]):
+        if sample < 1.0:
+            files = random.sample(files, k=round(len(files) * sample))
+
+        click.echo(f"Rehashing {len(files)} files...")
+
+        def _compute(pair) -> t.Optional[str]:
+            _, live = pair
+            try:
+                return compute_filehash(self.path / live.path)
+            except FileNotFoundError:
+                # deleted from live tree since it was scanned:
+                return None
+            except ValueError:
+                # truncated since it was scanned, empty files cannot be mapped:
+                return FILEHASH_EMPTY
+            except OSError as ex:
+                _logger.warning(f"File inaccessible: {ex}")
+                return FILEHASH_INACCESSIBLE_FILE
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            hashes = executor.map(_compute, files)
+            for (indexed, live), filehash in tqdm.tqdm(
+                zip(files, hashes), total=len(files), unit="files"
+            ):
+                if filehash is None:
+                    self.missing.append(indexed)
+                elif filehash != indexed.fhash:
+                    self.updated.append((indexed, live._replace(fhash=filehash)))
+
+        self.missing.sort(key=lambda f: f.path)
+        self.updated.sort(key=lambda pair: pair[0].path)
+
+    def get_meta(self, key: str) -> t.Optional[str]:
+        if key == META_CREATED:
+            return self.created.isoformat()
+        if key == META_VERSION:
+            return findex.__version__
+        return None
+
+    def get_index_meta(self, key: str, table_suffix: str) -> t.Optional[str]:
+        if table_suffix == "1":
+            # meta data of index refers to its first root, use the verified one instead:
+            root = self._root()
+            if key == META_ROOT_SPECIFIED:
+                return root.specified
+            if key in (META_ROOT_RESOLVED, META_ROOTS):
+                return root.resolved
+            if key == META_CREATED:
+                return str(root.added)
+
+            with opened_storage(self.index):
+                return self.index.get_meta(key)
+
+        if key in (META_ROOT_SPECIFIED, META_ROOT_RESOLVED):
+            return str(self.path.resolve() if key == META_ROOT_RESOLVED else self.path)
+        return self.get_meta(key)
+
+    def _root(self) -> Root:
+        """Return root of index verified, the first one if the directory is none of them."""
+        root_id = self.index.find_root(str(self.path))
+        roots = self.index.roots()
+        return next((root for root in roots if root.id == root_id), roots[0])
+
+    def iter_missing(self, *, include_updated=False):
+        """Return files in index, but no longer in directory."""
+        if include_updated:
+            return sorted(
+                self.missing + [indexed for indexed, _ in self.updated],
+                key=lambda f: f.path,
+            )
+        return iter(self.missing)
+
+    def iter_new(self, *, include_updated=False):
+        """Return files in directory, but not in index."""
+        if include_updated:
+            return sorted(
+                self.new + [live for _, live in self.updated], key=lambda f: f.path
+            )
+        return iter(self.new)
+
+    def iter_updated(self):
+        """Return indexed files that have changed in directory."""
+        return (indexed for indexed, _ in self.updated)
+
+    def iter_content_groups(self) -> t.Iterable[FilesMap]:
+        """Verification matches files by path only, moved content is not detected."""
+        return iter(())
+
+    def iter_hardlink_groups(self, table_suffix: str):
+        """Verification does not track file identities, no hard links are reported."""
+        return iter(())
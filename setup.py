@@ -11,6 +11,7 @@ setup(
     author_email="mike@mpagel.de",
     packages=find_packages(exclude=["tests"]),
     install_requires=["click", "colorama", "daiquiri", "tqdm", "xlsxwriter"],
+    extras_require={"memory": ["numpy"]},
     include_package_data=True,
     entry_points={"console_scripts": ["findex = findex.cli:cli"]},
 )
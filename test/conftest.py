@@ -1,6 +1,7 @@
 """Common fixtures and configurations for this test directory."""
 import os
 import pathlib
+import random
 import shutil
 
 import pytest
@@ -22,3 +23,13 @@ def output_dir(cwd_module_dir):
     os.makedirs(path)
     yield pathlib.Path(path)
     shutil.rmtree(path, ignore_errors=False)
+
+
+@pytest.fixture
+def random_bytes():
+    """Return function generating reproducible pseudo-random data of given size."""
+
+    def _random_bytes(size):
+        return random.Random(0).getrandbits(8 * size).to_bytes(size, "little")
+
+    return _random_bytes
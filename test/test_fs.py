@@ -0,0 +1,206 @@
+import hashlib
+import io
+import os
+import pathlib
+import shutil
+import tarfile
+import zipfile
+
+import pytest
+
+from findex.fs import (
+    XATTR_HASH,
+    XATTR_SUPPORTED,
+    Chunker,
+    compute_filehash,
+    iter_files,
+    iter_records,
+    scan,
+    walk,
+)
+
+
+def _xattr_usable(path):
+    try:
+        os.setxattr(path, XATTR_HASH, b"")
+        os.removexattr(path, XATTR_HASH)
+    except OSError:
+        return False
+    return True
+
+
+@pytest.fixture
+def cached_file(tmp_path):
+    path = tmp_path / "file.txt"
+    path.write_text("content")
+
+    if not XATTR_SUPPORTED or not _xattr_usable(path):
+        pytest.skip("Extended attributes not available.")
+
+    return path
+
+
+def test__walk__hash_cache_written(cached_file):
+    (filedesc,) = walk(cached_file.parent, hash_cache=True)
+    assert filedesc.fhash == compute_filehash(cached_file)
+    assert os.getxattr(cached_file, XATTR_HASH).decode().endswith(filedesc.fhash)
+
+
+def test__walk__hash_cache_read(cached_file):
+    list(walk(cached_file.parent, hash_cache=True))
+
+    # replace cached hash to detect it is used instead of file content:
+    key, _, _ = os.getxattr(cached_file, XATTR_HASH).decode().rpartition(":")
+    os.setxattr(cached_file, XATTR_HASH, f"{key}:cached".encode())
+
+    (filedesc,) = walk(cached_file.parent, hash_cache=True)
+    assert filedesc.fhash == "cached"
+
+    (filedesc,) = walk(cached_file.parent)
+    assert filedesc.fhash == compute_filehash(cached_file)
+
+
+def test__walk__hash_cache_invalidated(cached_file):
+    list(walk(cached_file.parent, hash_cache=True))
+    key, _, _ = os.getxattr(cached_file, XATTR_HASH).decode().rpartition(":")
+    os.setxattr(cached_file, XATTR_HASH, f"{key}:cached".encode())
+
+    stat = cached_file.stat()
+    os.utime(cached_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+    (filedesc,) = walk(cached_file.parent, hash_cache=True)
+    assert filedesc.fhash == compute_filehash(cached_file)
+
+
+def test__scan__sorted_by_path(tmp_path):
+    for relpath in ("a-b", "a/c", "a/b/d", "b", "a.txt"):
+        path = tmp_path / relpath
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(relpath)
+
+    paths = [path for path, _ in scan(tmp_path)]
+    assert paths == sorted(paths)
+    assert len(paths) == 5
+
+
+def test__iter_files__hard_links_hashed_once(tmp_path, monkeypatch):
+    (tmp_path / "file.txt").write_text("content")
+    os.link(tmp_path / "file.txt", tmp_path / "link.txt")
+
+    hashed = []
+    monkeypatch.setattr(
+        "findex.fs.compute_filehash", lambda path: hashed.append(path) or "hash"
+    )
+
+    files = list(iter_files(tmp_path))
+    assert len(hashed) == 1
+    assert [f.fhash for f, _, _ in files] == ["hash", "hash"]
+    assert {fileid.links for _, fileid, _ in files} == {2}
+    assert len({(fileid.device, fileid.inode) for _, fileid, _ in files}) == 1
+
+
+def _chunk(data, block_size=1000):
+    chunker = Chunker(min_size=64, avg_size=256, max_size=1024)
+    chunks = []
+    for offset in range(0, len(data), block_size):
+        chunks.extend(chunker.update(data[offset : offset + block_size]))
+    return chunks + chunker.finish()
+
+
+def test__chunker__boundaries(random_bytes):
+    data = random_bytes(100_000)
+    chunks = _chunk(data)
+
+    assert sum(c.size for c in chunks) == len(data)
+    assert all(64 <= c.size <= 1024 for c in chunks[:-1])
+    assert [c.offset for c in chunks[1:]] == [c.offset + c.size for c in chunks[:-1]]
+    assert chunks[0].fhash == hashlib.sha1(data[: chunks[0].size]).hexdigest()
+
+    # boundaries depend on content only:
+    assert _chunk(data, block_size=77) == chunks
+
+
+def test__chunker__insertion_changes_few_chunks(random_bytes):
+    data = random_bytes(100_000)
+    changed = data[:50_000] + b"inserted" + data[50_000:]
+
+    hashes = {c.fhash for c in _chunk(data)}
+    changed_hashes = {c.fhash for c in _chunk(changed)}
+    assert len(changed_hashes - hashes) <= 3
+
+
+def test__chunker__without_numpy(random_bytes, monkeypatch):
+    pytest.importorskip("numpy")
+    data = random_bytes(100_000)
+    chunks = _chunk(data)
+
+    # rolling hash computed byte by byte finds the same boundaries:
+    monkeypatch.setattr("findex.fs.np", None)
+    assert _chunk(data, block_size=77) == chunks
+
+
+def test__iter_records__plain_tuples(cwd_module_dir):
+    top = pathlib.Path("input", "folder1")
+    records = sorted(iter_records(top))
+    files = sorted(walk(top))
+
+    assert [type(r) for r in records] == [tuple] * len(files)
+    assert [(r[0], r[1], r[2]) for r in records] == [(f.path, f.size, f.fhash) for f in files]
+    assert all(isinstance(r[4], int) for r in records)
+
+
+@pytest.mark.parametrize("suffix", [".tar.gz", ".zip"])
+def test__iter_files__into_archives(tmp_path, cwd_module_dir, suffix):
+    folder = pathlib.Path("input", "folder1")
+    archive = tmp_path / "tree" / f"archive{suffix}"
+    archive.parent.mkdir()
+
+    if suffix == ".zip":
+        with zipfile.ZipFile(archive, "w") as zip_file:
+            for f in walk(folder):
+                zip_file.write(folder / f.path, pathlib.Path(f.path).as_posix())
+    else:
+        with tarfile.open(archive, "w:gz") as tar_file:
+            tar_file.add(folder, ".")
+
+    files = {f.path: (f, i) for f, i, _ in iter_files(archive.parent, into_archives=True)}
+    assert files.pop(archive.name)[0].fhash == compute_filehash(archive)
+
+    members = {path[len(archive.name) + 1 :]: f.fhash for path, (f, _) in files.items()}
+    assert members == {f.path: f.fhash for f in walk(folder)}
+    assert all(i.inode is None for _, i in files.values())
+
+    # archives are opaque files by default:
+    assert [f.path for f in walk(archive.parent)] == [archive.name]
+
+
+def test__iter_files__into_archives__invalid(tmp_path):
+    shutil.copy(__file__, tmp_path / "invalid.tar")
+
+    (filedesc,) = walk(tmp_path)
+    files = [f for f, _, _ in iter_files(tmp_path, into_archives=True)]
+    assert files == [filedesc]
+
+
+def test__iter_files__into_archives__duplicate_members(tmp_path):
+    archive = tmp_path / "archive.tar"
+    with tarfile.open(archive, "w") as tar_file:
+        for name, content in (("x.txt", b"first"), ("./x.txt", b"second")):
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            tar_file.addfile(info, io.BytesIO(content))
+
+    files = [f for f, _, _ in iter_files(tmp_path, into_archives=True)]
+    assert [(f.path, f.fhash) for f in files if f.path != archive.name] == [
+        (os.path.join(archive.name, "x.txt"), hashlib.sha1(b"second").hexdigest())
+    ]
+
+
+def test__iter_files__into_archives__members_outside_skipped(tmp_path):
+    archive = tmp_path / "archive.zip"
+    with zipfile.ZipFile(archive, "w") as zip_file:
+        for name in ("../evil.txt", "a/../../evil.txt", "/a/./b.txt"):
+            zip_file.writestr(name, "content")
+
+    paths = [f.path for f, _, _ in iter_files(tmp_path, into_archives=True)]
+    assert paths == [os.path.join(archive.name, "a", "b.txt"), archive.name]
@@ -1,12 +1,18 @@
+import contextlib
+import functools
+import os
 import pathlib
+import sqlite3
 
 import pytest
 
-from findex.index import Index, Comparison
+from findex.db import DbVersionError, opened_storage
+from findex.fs import Chunker, iter_records
+from findex.index import Comparison, ComparisonResult, Index, RootExistsError
 
 
 @pytest.fixture(scope="module")
-def comparison(cwd_module_dir, output_dir):
+def indices(cwd_module_dir, output_dir):
     input_dir = pathlib.Path("input")
 
     index1 = Index(output_dir / "index1.db")
@@ -15,11 +21,27 @@ def comparison(cwd_module_dir, output_dir):
     index2 = Index(output_dir / "index2.db")
     index2.create(input_dir / "folder2")
 
-    comparison = Comparison(output_dir / "comparison.db")
+    return index1, index2
+
+
+def _create_comparison(kind, index1, index2, path):
+    """Return comparison of given kind, either in a database at path or in memory."""
+    if kind == "memory":
+        pytest.importorskip("numpy")
+        from findex.memory import MemoryComparison
+
+        return MemoryComparison().create(index1, index2)
+
+    comparison = Comparison(path)
     comparison.create(index1, index2)
     return comparison
 
 
+@pytest.fixture(scope="module", params=["db", "memory"])
+def comparison(request, indices, output_dir):
+    return _create_comparison(request.param, *indices, output_dir / "comparison.db")
+
+
 def test__missing_files(comparison):
     files = list(pathlib.Path(f.path) for f in comparison.iter_missing())
     assert len(files) == 1
@@ -81,3 +103,292 @@ def test__content_groups(comparison):
         {pathlib.Path("empty1.txt"), pathlib.Path("sub1", "empty2.txt")},
         {pathlib.Path("empty3.txt")},
     ) in file_groups
+
+
+@pytest.fixture(scope="module", params=["db", "memory"])
+def linked_comparison(request, tmp_path_factory):
+    path = tmp_path_factory.mktemp("linked")
+    for folder in ("folder1", "folder2"):
+        (path / folder).mkdir()
+        (path / folder / "data.txt").write_text("data")
+        os.link(path / folder / "data.txt", path / folder / "link.txt")
+    (path / "folder2" / "copy.txt").write_text("data")
+
+    index1 = Index(path / "index1.db")
+    index1.create(path / "folder1")
+    index2 = Index(path / "index2.db")
+    index2.create(path / "folder2")
+
+    return _create_comparison(request.param, index1, index2, path / "comparison.db")
+
+
+def test__hardlink_groups(linked_comparison):
+    groups = list(linked_comparison.iter_hardlink_groups("1"))
+    assert [g.files for g in groups] == [["data.txt", "link.txt"]]
+
+    groups = list(linked_comparison.iter_hardlink_groups("2"))
+    assert [g.files for g in groups] == [["data.txt", "link.txt"]]
+
+
+def test__content_groups__hard_links_not_duplicates(linked_comparison):
+    (group,) = linked_comparison.iter_content_groups()
+    assert len(group.files1) == 2
+    assert group.copies1 == 1
+    assert len(group.files2) == 3
+    assert group.copies2 == 2
+
+
+def test__fingerprint(indices):
+    index1, index2 = indices
+    assert index1.fingerprint() != index2.fingerprint()
+
+    with opened_storage(index1):
+        assert index1.fingerprint() == index1._compute_fingerprint()
+
+
+def test__comparison_update(indices, tmp_path):
+    index1, index2 = indices
+
+    comparison = Comparison(tmp_path / "comparison.db")
+    comparison.create(index1, index1)
+    assert not comparison.update(index1, index1)
+
+    assert comparison.update(index1, index2)
+    assert not comparison.update(index1, index2)
+
+    expected = Comparison(tmp_path / "expected.db")
+    expected.create(index1, index2)
+
+    for table in ("file1", "file2"):
+        query = f"SELECT * FROM {table} ORDER BY path"
+        with opened_storage(comparison), opened_storage(expected):
+            assert (
+                comparison.connection.execute(query).fetchall()
+                == expected.connection.execute(query).fetchall()
+            )
+
+    assert list(comparison.iter_updated()) == list(expected.iter_updated())
+
+
+@pytest.mark.parametrize("kind", ["db", "memory"])
+def test__chunk_deltas(tmp_path, monkeypatch, random_bytes, kind):
+    monkeypatch.setattr(
+        "findex.fs.Chunker", functools.partial(Chunker, min_size=64, avg_size=256, max_size=1024)
+    )
+
+    data = random_bytes(100_000)
+    for folder, content in (("folder1", data), ("folder2", data[:50_000] + b"x" + data[50_000:])):
+        (tmp_path / folder).mkdir()
+        (tmp_path / folder / "large.bin").write_bytes(content)
+        (tmp_path / folder / "small.txt").write_text(folder)
+
+    index1 = Index(tmp_path / "index1.db")
+    index1.create(tmp_path / "folder1", chunk_threshold=1000)
+    index2 = Index(tmp_path / "index2.db")
+    index2.create(tmp_path / "folder2", chunk_threshold=1000)
+    assert index1.lookup(path="small.txt")[0].size == 7
+
+    comparison = _create_comparison(kind, index1, index2, tmp_path / "comparison.db")
+
+    (delta,) = comparison.iter_chunk_deltas()
+    assert delta.path == "large.bin"
+    assert delta.size == 100_001
+    assert 0 < delta.changed_bytes < 3 * 1024
+    assert delta.ratio == delta.changed_bytes / delta.size
+
+
+def test__concurrent_create(tmp_path, monkeypatch, cwd_module_dir):
+    monkeypatch.setattr("findex.index.DATABASE_TRANSACTION_SIZE", 2)
+    path = tmp_path / "index.db"
+    observed = []
+
+    def _iter_records(*args, **kwargs):
+        for number, record in enumerate(iter_records(*args, **kwargs)):
+            if number == 5:
+                reader = Index(path)
+                observed.append((reader.count(), reader.progress()))
+                with opened_storage(reader):
+                    observed.append(
+                        reader.connection.execute("PRAGMA journal_mode").fetchone()[0]
+                    )
+            yield record
+
+    monkeypatch.setattr("findex.index.iter_records", _iter_records)
+
+    index = Index(path, concurrent=True)
+    index.create(pathlib.Path("input", "folder1"))
+
+    (count, progress), journal_mode = observed
+    assert journal_mode == "wal"
+    assert count == progress.files_written == 4
+    assert progress.files_total == 8
+    assert not progress.completed
+
+    assert index.progress() == (8, 8, True)
+
+
+@pytest.fixture
+def multi_root_index(cwd_module_dir, tmp_path):
+    input_dir = pathlib.Path("input")
+
+    index = Index(tmp_path / "index.db")
+    index.create(input_dir / "folder1")
+    index.add_root(input_dir / "folder2")
+    return index
+
+
+def test__multi_root__paths(multi_root_index, indices):
+    index1, index2 = indices
+    root1, root2 = multi_root_index.roots()
+    assert multi_root_index.find_root(str(pathlib.Path("input", "folder2"))) == root2.id
+    assert multi_root_index.count() == index1.count() + index2.count()
+
+    assert list(multi_root_index.iter_all(ordered=True, root=root1.id)) == list(
+        index1.iter_all(ordered=True)
+    )
+    paths = [f.path for f in multi_root_index.iter_all(ordered=True)]
+    assert paths == sorted(paths)
+    assert paths == sorted(
+        [os.path.join(root1.resolved, f.path) for f in index1.iter_all()]
+        + [os.path.join(root2.resolved, f.path) for f in index2.iter_all()]
+    )
+
+
+def test__multi_root__add_existing(multi_root_index):
+    with pytest.raises(RootExistsError):
+        multi_root_index.add_root(pathlib.Path("input", "folder1"))
+
+
+def test__multi_root__duplicates(multi_root_index, indices):
+    index1, index2 = indices
+    # hashes of special entries like empty files are no duplicates:
+    hashes1 = {f.fhash for f in index1.iter_all() if not f.fhash.startswith("_")}
+    hashes2 = {f.fhash for f in index2.iter_all()}
+
+    groups = list(multi_root_index.iter_duplicates())
+    assert {g.fhash for g in groups} == hashes1 & hashes2
+    assert all(os.path.isabs(path) for g in groups for path in g.files)
+
+
+def test__multi_root__difference(multi_root_index, indices):
+    index1, index2 = indices
+    root1, root2 = (r.id for r in multi_root_index.roots())
+    hashes2 = {f.fhash for f in index2.iter_all()}
+
+    files = list(multi_root_index.iter_root_difference(root1, root2))
+    assert files == [f for f in index1.iter_all(ordered=True) if f.fhash not in hashes2]
+
+
+def test__comparison_result__abstract():
+    class Incomplete(ComparisonResult):
+        def iter_missing(self, *, include_updated=False):
+            return iter(())
+
+    with pytest.raises(TypeError):
+        Incomplete()
+
+
+BASELINE_COMPARISON_SCHEMA = """
+CREATE TABLE file1 (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    hash TEXT NOT NULL,
+    created TIMESTAMP NULL,
+    modified TIMESTAMP NULL
+);
+CREATE TABLE file2 (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    hash TEXT NOT NULL,
+    created TIMESTAMP NULL,
+    modified TIMESTAMP NULL
+);
+CREATE TABLE meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+@pytest.fixture
+def baseline_comparison(indices, tmp_path):
+    """Comparison of indices as created by versions before file identities and chunks."""
+    current = Comparison(tmp_path / "current.db")
+    current.create(*indices)
+
+    path = tmp_path / "baseline.db"
+    connection = sqlite3.connect(path)
+    connection.executescript(BASELINE_COMPARISON_SCHEMA)
+    connection.execute("ATTACH DATABASE ? AS current;", (str(current.path),))
+    for table in ("file1", "file2"):
+        connection.execute(
+            f"INSERT INTO {table} SELECT path,size,hash,created,modified FROM current.{table};"
+        )
+    connection.execute(
+        "INSERT INTO meta SELECT * FROM current.meta WHERE key NOT LIKE '%FINGERPRINT';"
+    )
+    connection.commit()
+    connection.close()
+
+    return Comparison(path), current
+
+
+def test__baseline_comparison__content_groups(baseline_comparison):
+    comparison, current = baseline_comparison
+
+    # without hard links in the trees, paths count as copies just like file identities:
+    assert list(comparison.iter_content_groups()) == list(current.iter_content_groups())
+    assert not list(comparison.iter_hardlink_groups("1"))
+    assert not list(comparison.iter_chunk_deltas())
+
+
+def test__baseline_comparison__update(baseline_comparison, indices):
+    comparison, _ = baseline_comparison
+    with pytest.raises(DbVersionError):
+        comparison.update(*indices)
+
+
+def test__multi_root__comparison_update(multi_root_index, indices, tmp_path, monkeypatch):
+    index1, _ = indices
+
+    comparison = Comparison(tmp_path / "comparison.db")
+    comparison.create(index1, index1)
+
+    def _reload_index(*args):
+        raise AssertionError("index reloaded instead of updated")
+
+    monkeypatch.setattr(Comparison, "_reload_index", _reload_index)
+    assert comparison.update(index1, multi_root_index)
+
+    expected = Comparison(tmp_path / "expected.db")
+    expected.create(index1, multi_root_index)
+
+    query = "SELECT * FROM file2 ORDER BY path"
+    with opened_storage(comparison), opened_storage(expected):
+        assert (
+            comparison.connection.execute(query).fetchall()
+            == expected.connection.execute(query).fetchall()
+        )
+
+
+def test__concurrent_read__progress_unchanged(tmp_path, cwd_module_dir):
+    path = tmp_path / "index.db"
+    Index(path, concurrent=True).create(pathlib.Path("input", "folder1"))
+    progress = Index(path).progress()
+
+    reader = Index(path, concurrent=True)
+    assert reader.count() == 8
+    assert reader.progress() == progress
+    assert Index(path).progress() == progress == (8, 8, True)
+
+
+@pytest.mark.parametrize("kind", ["db", "memory"])
+def test__multi_root__comparison_roots(multi_root_index, indices, tmp_path, kind):
+    index1, _ = indices
+    comparison = _create_comparison(kind, index1, multi_root_index, tmp_path / "comparison.db")
+
+    with contextlib.closing(comparison.open()):
+        assert comparison.get_index_roots("1") == [r.resolved for r in index1.roots()]
+        assert comparison.get_index_roots("2") == [
+            r.resolved for r in multi_root_index.roots()
+        ]
@@ -0,0 +1,131 @@
+import contextlib
+import json
+import pathlib
+import shutil
+import threading
+import urllib.error
+import urllib.request
+
+import pytest
+
+from findex.index import Comparison, Index
+from findex.serve import DatabaseCache, UnavailableDatabaseError, create_server
+
+
+@pytest.fixture
+def cache(tmp_path, cwd_module_dir):
+    input_dir = pathlib.Path("input")
+
+    index1 = Index(tmp_path / "index1.db")
+    index1.create(input_dir / "folder1")
+    index2 = Index(tmp_path / "index2.db")
+    index2.create(input_dir / "folder2")
+    Comparison(tmp_path / "comparison.db").create(index1, index2)
+
+    cache = DatabaseCache()
+    cache.register("index1", Index, index1.path)
+    cache.register("index2", Index, index2.path)
+    cache.register("comparison", Comparison, tmp_path / "comparison.db")
+    return cache
+
+
+@pytest.fixture
+def query(cache):
+    server = create_server(cache, port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    def _query(url):
+        port = server.server_address[1]
+        url = f"http://127.0.0.1:{port}{url}"
+        with contextlib.closing(urllib.request.urlopen(url, timeout=10)) as r:
+            return json.load(r)
+
+    yield _query
+
+    server.shutdown()
+    server.server_close()
+
+
+def _load(cache, name):
+    with cache.use(name) as storage:
+        return storage
+
+
+def test__cache__lru_eviction(cache):
+    _load(cache, "index1")
+    cache.memory_limit = cache.memory_used
+
+    _load(cache, "index2")
+    assert list(cache.loaded) == ["index2"]
+
+    cache.memory_limit *= 2
+    _load(cache, "index1")
+    _load(cache, "index2")
+    assert list(cache.loaded) == ["index1", "index2"]
+
+
+def test__cache__evicted_while_in_use(cache):
+    with cache.use("index1") as index:
+        cache.memory_limit = 1
+        _load(cache, "index2")
+        assert list(cache.loaded) == ["index2"]
+
+        # evicted database is closed by its last user:
+        assert index.count() == 8
+    assert not index.opened
+
+
+def test__cache__reload_changed(cache, tmp_path):
+    index = _load(cache, "index1")
+    assert _load(cache, "index1") is index
+
+    shutil.copy(tmp_path / "index2.db", tmp_path / "index1.db")
+    with cache.use("index1") as reloaded:
+        assert reloaded is not index
+        assert reloaded.lookup(path="missing1.txt") == []
+
+
+def test__cache__missing_file(cache, tmp_path):
+    path = tmp_path / "index1.db"
+    index = _load(cache, "index1")
+
+    # loaded copy is served while file is recreated:
+    path.unlink()
+    assert _load(cache, "index1") is index
+
+    del cache.loaded["index1"]
+    with pytest.raises(UnavailableDatabaseError):
+        _load(cache, "index1")
+    assert not path.exists()
+
+
+def test__cache__exceeding_memory_limit(cache, caplog):
+    cache.memory_limit = 1
+    with cache.use("index1") as index:
+        assert index.count() == 8
+    assert "exceeds memory limit" in caplog.text
+
+
+def test__query__lookup(query):
+    (file,) = query("/lookup?db=index1&path=missing1.txt")
+    assert query(f"/lookup?db=index1&hash={file['fhash']}") == [file]
+
+
+def test__query__compare(query):
+    assert [f["path"] for f in query("/compare?db=comparison&result=missing")] == [
+        "missing1.txt"
+    ]
+    assert query("/report?db=comparison")["groups"] == 4
+
+
+def test__query__other_database_in_use(cache, query):
+    with cache.use("comparison"):
+        assert query("/lookup?db=index1&path=missing1.txt")
+
+
+def test__query__unavailable(cache, query, tmp_path):
+    (tmp_path / "index1.db").unlink()
+    with pytest.raises(urllib.error.HTTPError) as error:
+        query("/lookup?db=index1&path=missing1.txt")
+    assert error.value.code == 503
@@ -0,0 +1,106 @@
+import os
+import pathlib
+import shutil
+import tarfile
+
+import pytest
+
+from findex.index import META_ROOT_RESOLVED, Index
+from findex.verify import Verification
+
+
+@pytest.fixture
+def tree(tmp_path, cwd_module_dir):
+    path = tmp_path / "tree"
+    shutil.copytree(pathlib.Path("input", "folder1"), path)
+
+    index = Index(tmp_path / "index.db")
+    index.create(path)
+    return index, path
+
+
+def test__verify__unchanged(tree):
+    index, path = tree
+    verification = Verification(index, path)
+    verification.run(deep=True)
+
+    assert not list(verification.iter_missing())
+    assert not list(verification.iter_new())
+    assert not list(verification.iter_updated())
+
+
+def test__verify__quick(tree):
+    index, path = tree
+    (path / "missing1.txt").unlink()
+    (path / "sub1" / "new.txt").write_text("new")
+    (path / "updated1.txt").write_text("updated with different size")
+
+    verification = Verification(index, path)
+    verification.run()
+
+    assert [f.path for f in verification.iter_missing()] == ["missing1.txt"]
+    assert [f.path for f in verification.iter_new()] == [os.path.join("sub1", "new.txt")]
+    assert [f.path for f in verification.iter_updated()] == ["updated1.txt"]
+
+
+def test__verify__deep(tree):
+    index, path = tree
+    filepath = path / "single.txt"
+    stat = filepath.stat()
+    filepath.write_bytes(bytes(b ^ 1 for b in filepath.read_bytes()))
+    os.utime(filepath, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+    verification = Verification(index, path)
+    verification.run()
+    assert not list(verification.iter_updated())
+
+    verification.run(deep=True, workers=2)
+    assert [f.path for f in verification.iter_updated()] == ["single.txt"]
+
+
+def test__verify__into_archives(tmp_path, cwd_module_dir):
+    path = tmp_path / "tree"
+    path.mkdir()
+    with tarfile.open(path / "archive.tar", "w") as tar_file:
+        tar_file.add(pathlib.Path("input", "folder1"), "folder1")
+
+    index = Index(tmp_path / "index.db")
+    index.create(path, into_archives=True)
+    assert index.count() > 1
+    assert index.progress() == (index.count(), index.count(), True)
+
+    verification = Verification(index, path)
+    verification.run(deep=True)
+
+    assert not list(verification.iter_missing())
+    assert not list(verification.iter_new())
+    assert not list(verification.iter_updated())
+
+
+def test__verify__deep__changed_while_rehashing(tree, monkeypatch):
+    index, path = tree
+    scanned = list(Verification(index, path)._iter_live())
+
+    # files deleted or truncated between scan and rehash:
+    monkeypatch.setattr(Verification, "_iter_live", lambda self: iter(scanned))
+    (path / "missing1.txt").unlink()
+    (path / "single.txt").write_bytes(b"")
+
+    verification = Verification(index, path)
+    verification.run(deep=True)
+
+    assert [f.path for f in verification.iter_missing()] == ["missing1.txt"]
+    assert [f.path for f in verification.iter_updated()] == ["single.txt"]
+
+
+def test__verify__root_of_several(tree, tmp_path, cwd_module_dir):
+    index, path = tree
+    other = pathlib.Path("input", "folder2")
+    index.add_root(other)
+
+    verification = Verification(index, other.absolute())
+    verification.run()
+
+    assert not list(verification.iter_missing())
+    assert verification.get_index_meta(META_ROOT_RESOLVED, "1") == str(other.resolve())
+    assert verification.get_index_roots("1") == [str(other.resolve())]